@@ -0,0 +1,127 @@
+from itertools import repeat, starmap
+from operator import itemgetter, le, mul
+
+from result_stream import ResultSet
+
+# --- FORMATO DE RESPUESTAS ---
+# Las respuestas de plantilla se arman por columnas: cada columna se extrae de
+# una sola pasada (directo de las tuplas si el resultado es un ResultSet), las
+# estadísticas se calculan con funciones nativas sobre esas listas y el texto
+# se compone con plantillas precompiladas y un único join, sin `msg +=`.
+
+
+def project(results, names, defaults=None):
+    """Filas como tuplas con las columnas `names`, sin crear diccionarios"""
+    defaults = defaults or {}
+    if isinstance(results, ResultSet):
+        index = {name: i for i, name in enumerate(results.columns)}
+        if all(name in index for name in names):
+            if len(names) == 1:
+                position = index[names[0]]
+                return [(row[position],) for row in results.rows]
+            return list(map(itemgetter(*(index[name] for name in names)), results.rows))
+    return [tuple(row.get(name, defaults.get(name)) for name in names) for row in results]
+
+
+def column(results, name, default=None, numeric=False):
+    """Valores de una columna; con `numeric` los nulos cuentan como 0"""
+    if isinstance(results, ResultSet) and name in results.columns:
+        values = list(map(itemgetter(results.columns.index(name)), results.rows))
+    else:
+        values = [row.get(name, default) for row in results]
+    if numeric and None in values:
+        values = [0 if value is None else value for value in values]
+    return values
+
+
+def count_at_most(values, limit):
+    """Cantidad de valores <= limit"""
+    return sum(map(le, values, repeat(limit)))
+
+
+def stock_stats(cantidades, precios, low_stock=50):
+    """Unidades totales, valor del inventario y productos con stock bajo en una pasada por columna"""
+    return {
+        "total_unidades": sum(cantidades),
+        "valor_total": sum(map(mul, map(float, precios), cantidades)),
+        "bajo_stock": count_at_most(cantidades, low_stock),
+    }
+
+
+def block(lines):
+    """Unir líneas en un bloque terminado en salto de línea (vacío si no hay líneas)"""
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def render(template, rows):
+    """Aplicar una plantilla (str.format ya ligado) a cada tupla y armar el bloque"""
+    return block(list(starmap(template, rows)))
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+    from decimal import Decimal
+
+    # Benchmark: formato anterior (msg += y varias pasadas) contra el motor por columnas
+    def legacy_stock_summary(rows):
+        count = len(rows)
+        msg = f"📦 **Se encontraron {count} productos en tu inventario:**\n\n"
+        total_unidades = sum(p.get('cantidad', 0) for p in rows)
+        valor_total = sum(float(p.get('precio_venta', 0)) * p.get('cantidad', 0) for p in rows)
+        msg += f"• Total unidades: {total_unidades:,}\n"
+        msg += f"• Valor estimado inventario: ${valor_total:,.2f}\n\n"
+        productos_bajo_stock = [p for p in rows if p.get('cantidad', 0) <= 50]
+        msg += f"⚠️ **Alerta**: {len(productos_bajo_stock)} productos con stock ≤ 50 unidades\n\n"
+        return msg
+
+    def legacy_listing(rows):
+        response = "Stock de todos los productos:\n"
+        for product in rows:
+            status = f"{product['stock']} unidades" if product['stock'] > 0 else "AGOTADO"
+            response += f"• {product['name']}: {status}\n"
+        return response
+
+    def new_stock_summary(rows):
+        stats = stock_stats(column(rows, 'cantidad', 0, numeric=True),
+                            column(rows, 'precio_venta', 0, numeric=True))
+        return "".join([
+            f"📦 **Se encontraron {len(rows)} productos en tu inventario:**\n\n",
+            f"• Total unidades: {stats['total_unidades']:,}\n",
+            f"• Valor estimado inventario: ${stats['valor_total']:,.2f}\n\n",
+            f"⚠️ **Alerta**: {stats['bajo_stock']} productos con stock ≤ 50 unidades\n\n",
+        ])
+
+    in_stock = "• {}: {} unidades".format
+    sold_out = "• {}: AGOTADO".format
+
+    def new_listing(rows):
+        lines = [in_stock(name, stock) if stock > 0 else sold_out(name)
+                 for name, stock in project(rows, ("name", "stock"))]
+        return "Stock de todos los productos:\n" + block(lines)
+
+    random.seed(7)
+    for size in (10_000, 100_000):
+        columns = ("id", "nombre", "cantidad", "precio_venta", "name", "stock")
+        tuples = []
+        for i in range(size):
+            cantidad = random.randint(0, 500)
+            tuples.append((i, f"Producto {i}", cantidad, Decimal(random.randint(100, 99999)) / 100,
+                           f"Producto {i}", cantidad))
+        result = ResultSet(columns, tuples)
+        dicts = result.as_dicts()
+        assert legacy_stock_summary(dicts) == new_stock_summary(result)
+        assert legacy_listing(dicts) == new_listing(result)
+
+        # Las consultas devuelven ResultSet: el formato anterior crea un dict por fila y pasada
+        print(f"{size:,} filas")
+        for name, func, rows in [
+            ("resumen anterior", legacy_stock_summary, result),
+            ("resumen anterior (dicts)", legacy_stock_summary, dicts),
+            ("resumen por columnas", new_stock_summary, result),
+            ("listado anterior", legacy_listing, result),
+            ("listado anterior (dicts)", legacy_listing, dicts),
+            ("listado con plantillas", new_listing, result),
+        ]:
+            seconds = min(timeit.repeat(lambda: func(rows), number=1, repeat=5))
+            print(f"  {name:>26}: {seconds * 1000:8.1f} ms")
@@ -1,11 +1,16 @@
-from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField
 from wtforms.validators import DataRequired, EqualTo
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import case, func
 import os
+import json
+from services import StreamFailure, get_ai_response, stream_ai_response
+import movement_ingest
+from lru_cache import LRUCache
 
 # --- Configuración de la Aplicación ---
 app = Flask(__name__)
@@ -15,6 +20,9 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 # Configurar la URI de la base de datos
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'app.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Umbral de "stock bajo" y segundos que se reutilizan las métricas del dashboard
+app.config['LOW_STOCK_THRESHOLD'] = 10
+app.config['METRICS_CACHE_TTL'] = 30
 
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
@@ -113,8 +121,6 @@ def dashboard():
     return render_template('dashboard.html')
 
 # --- API para el Chat ---
-from services import get_ai_response
-
 @app.route('/api/chat', methods=['POST'])
 #@login_required
 def api_chat():
@@ -123,15 +129,125 @@ def api_chat():
     if not message:
         return jsonify({'error': 'No se proporcionó ningún mensaje'}), 400
     
-    response = get_ai_response(message)
+    response = get_ai_response(message, user_id=current_user.get_id())
     return jsonify({'reply': response})
 
-# --- API para obtener productos (opcional, para debugging) ---
+@app.route('/api/chat/stream', methods=['POST'])
+#@login_required
+def api_chat_stream():
+    # Envía la respuesta como Server-Sent Events a medida que Gemini la genera;
+    # un fallo (incluso a mitad de la respuesta) llega como un evento "error" aparte
+    data = request.json
+    message = data.get('message')
+    if not message:
+        return jsonify({'error': 'No se proporcionó ningún mensaje'}), 400
+
+    user_id = current_user.get_id()
+
+    def generate():
+        for chunk in stream_ai_response(message, user_id=user_id):
+            if isinstance(chunk, StreamFailure):
+                yield f"event: error\ndata: {json.dumps({'message': str(chunk)})}\n\n"
+            else:
+                yield f"data: {json.dumps({'delta': chunk})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+# --- API de métricas agregadas para el dashboard ---
+metrics_cache = LRUCache(max_entries=32, max_bytes=256 * 1024, ttl=app.config['METRICS_CACHE_TTL'])
+
+def compute_metrics(low_stock):
+    """Conteos por estado de stock y valor de inventario por categoría en una sola pasada"""
+    stock = func.coalesce(Product.stock, 0)
+    rows = (db.session.query(
+                Product.category,
+                func.count(Product.id),
+                func.sum(case((stock > low_stock, 1), else_=0)),
+                func.sum(case(((stock > 0) & (stock <= low_stock), 1), else_=0)),
+                func.sum(case((stock <= 0, 1), else_=0)),
+                func.sum(Product.price * stock),
+            )
+            .group_by(Product.category)
+            .all())
+
+    totals = {'total': 0, 'in_stock': 0, 'low_stock': 0, 'out_of_stock': 0, 'inventory_value': 0.0}
+    categories = []
+    for category, total, in_stock, low, out, value in rows:
+        value = round(float(value or 0), 2)
+        categories.append({'category': category, 'products': total, 'inventory_value': value})
+        totals['total'] += total
+        totals['in_stock'] += in_stock or 0
+        totals['low_stock'] += low or 0
+        totals['out_of_stock'] += out or 0
+        totals['inventory_value'] += value
+    totals['inventory_value'] = round(totals['inventory_value'], 2)
+    categories.sort(key=lambda c: c['inventory_value'], reverse=True)
+    return {**totals, 'low_stock_threshold': low_stock, 'categories': categories}
+
+@app.route('/api/metrics', methods=['GET'])
+@login_required
+def api_metrics():
+    low_stock = request.args.get('low_stock', app.config['LOW_STOCK_THRESHOLD'], type=int)
+    metrics = metrics_cache.get(low_stock)
+    if metrics is None:
+        metrics = compute_metrics(low_stock)
+        metrics_cache.set(low_stock, metrics)
+    return jsonify(metrics)
+
+# --- API para obtener productos (paginada por keyset) ---
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'stock', 'category')
+
 @app.route('/api/products', methods=['GET'])
 @login_required
 def api_products():
-    products = Product.query.all()
-    return jsonify([product.to_dict() for product in products])
+    # /api/products?after_id=<último id visto>&limit=<tamaño>&fields=id,name,stock
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f] if fields else list(PRODUCT_FIELDS)
+    invalid = [f for f in fields if f not in PRODUCT_FIELDS]
+    if invalid:
+        return jsonify({'error': f"Campos no válidos: {', '.join(invalid)}"}), 400
+    if 'id' not in fields:
+        fields.insert(0, 'id')  # Necesario para el cursor de la siguiente página
+
+    rows = (db.session.query(*[getattr(Product, f) for f in fields])
+            .filter(Product.id > after_id)
+            .order_by(Product.id)
+            .limit(limit + 1)
+            .all())
+    has_more = len(rows) > limit
+    items = [dict(zip(fields, row)) for row in rows[:limit]]
+    return jsonify({
+        'items': items,
+        'next_after_id': items[-1]['id'] if has_more else None,
+    })
+
+# --- API de carga masiva de movimientos de inventario ---
+@app.route('/api/movements/import', methods=['POST'])
+@login_required
+def api_movements_import():
+    # Cuerpo CSV (text/csv) o NDJSON (application/x-ndjson), leído en streaming;
+    # /api/movements/import?format=ndjson&batch_size=5000
+    fmt = request.args.get('format') or movement_ingest.detect_format(request.mimetype)
+    if fmt not in movement_ingest.FORMATS:
+        return jsonify({'error': f"Formato no válido: {fmt}"}), 400
+    batch_size = request.args.get('batch_size', type=int)
+
+    try:
+        conn = movement_ingest.connect()
+    except Exception as e:
+        return jsonify({'error': f"Error conectando a la base de datos: {e}"}), 503
+    try:
+        report = movement_ingest.ingest(conn, movement_ingest.open_text(request.stream), fmt, batch_size)
+    finally:
+        conn.close()
+    return jsonify(report), 500 if report['error'] else 200
 
 
 if __name__ == '__main__':
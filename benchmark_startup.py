@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import textwrap
+
+# Benchmark de arranque en frío: cada punto de entrada se mide en un proceso
+# nuevo (sin módulos ya importados), separando la importación de la primera
+# solicitud. Uso: python benchmark_startup.py [repeticiones]
+
+ENTRY_POINTS = {
+    "app": (
+        "import app",
+        """
+        client = app.app.test_client()
+        client.get('/login')
+        """,
+    ),
+    "services": (
+        "import services",
+        """
+        services.analyze_user_intent('¿Cuánto stock hay de arroz?')
+        services.get_model()
+        """,
+    ),
+    "database_agent": (
+        "import database_agent",
+        """
+        try:
+            database_agent.DatabaseAgent()
+        except Exception as e:
+            print(f"aviso: {e}", file=sys.stderr)
+        """,
+    ),
+}
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+{import_stmt}
+imported = time.perf_counter()
+{first_request}
+done = time.perf_counter()
+print(f"{{imported - start:.4f}} {{done - imported:.4f}}")
+"""
+
+
+def measure(import_stmt, first_request):
+    """Devolver (segundos de importación, segundos de la primera solicitud)"""
+    code = SCRIPT.format(import_stmt=import_stmt, first_request=textwrap.dedent(first_request))
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", code],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    import_time, request_time = result.stdout.strip().splitlines()[-1].split()
+    return float(import_time), float(request_time)
+
+
+if __name__ == "__main__":
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"{'punto de entrada':>16} {'importación':>12} {'1ª solicitud':>13} {'total':>8}")
+    for name, (import_stmt, first_request) in ENTRY_POINTS.items():
+        try:
+            runs = [measure(import_stmt, first_request) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"{name:>16} Error: {e}")
+            continue
+        import_time, request_time = min(runs, key=sum)
+        print(f"{name:>16} {import_time * 1000:>10.0f}ms {request_time * 1000:>11.0f}ms "
+              f"{(import_time + request_time) * 1000:>6.0f}ms")
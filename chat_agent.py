@@ -24,8 +24,22 @@ def display_results(response):
     
     # Mostrar interpretación del agente
     st.success("🤖 **Respuesta del Agente:**")
+    if response.get('speculative'):
+        # Respuesta de la consulta predefinida más probable: Gemini no alcanzó a responder
+        st.warning("⏳ Respuesta provisional: se usó la consulta predefinida más parecida "
+                   "mientras Gemini preparaba una específica. Vuelve a preguntar en unos segundos.")
     st.write(response['interpretation'])
     
+    # Enriquecimiento opcional de Gemini (llega después de la respuesta inmediata)
+    if response.get('enrichment') is not None:
+        with st.spinner("🤖 Gemini está ampliando la respuesta..."):
+            try:
+                enrichment = response['enrichment'].result(timeout=60)
+            except Exception:
+                enrichment = None
+        if enrichment:
+            st.info(enrichment)
+    
     # Mostrar datos en tabla si hay resultados
     if response['results'] and len(response['results']) > 0:
         st.subheader(f"📊 Datos encontrados ({response['count']} registros)")
@@ -44,6 +58,8 @@ def display_results(response):
     # Mostrar consulta SQL generada (opcional)
     with st.expander("🔍 Ver consulta SQL generada"):
         st.code(response['sql'], language='sql')
+        if response.get('params'):
+            st.caption(f"Parámetros: {response['params']}")
 
 # --- APLICACIÓN PRINCIPAL ---
 st.title("🤖 Agente Inteligente de Consultas de Inventario")
@@ -149,7 +165,8 @@ if st.session_state.chat_history:
                 st.write(f"**Pregunta:** {question_item['content']}")
                 
                 if response_item['content'].get('interpretation'):
-                    st.write(f"**Respuesta:** {response_item['content']['interpretation']}")
+                    provisional = " _(provisional)_" if response_item['content'].get('speculative') else ""
+                    st.write(f"**Respuesta{provisional}:** {response_item['content']['interpretation']}")
                 
                 if response_item['content'].get('results'):
                     st.write(f"**Registros encontrados:** {len(response_item['content']['results'])}")
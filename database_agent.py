@@ -1,22 +1,1006 @@
-import google.generativeai as genai
 import mysql.connector
-import toml
 import os
-from dotenv import load_dotenv
 import json
 import re
+import threading
+import time
+import hashlib
+import csv
+import io
+import bisect
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from intent_router import AGENT_ROUTER, fold_accents
+from sql_guard import UnsafeQueryError, estimate_examined_rows, guard_sql
+from result_stream import ResultSet, column_names, fetch_result, stream_rows
+from lru_cache import LRUCache
+from llm_client import estimate_tokens
+from answer_format import block, column, count_at_most, project, render, stock_stats
+import registry
+
+
+def normalize_question(question):
+    """Normalizar una pregunta para usarla como clave de caché"""
+    text = re.sub(r'[^\w\s]', ' ', fold_accents(question))
+    return ' '.join(text.split())
+
+
+def hash_results(results):
+    """Huella estable de un conjunto de resultados"""
+    if isinstance(results, ResultSet):
+        results = {"columns": results.columns, "rows": results.rows}
+    payload = json.dumps(results, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _compact_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return f"{value:.2f}".rstrip('0').rstrip('.')
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _as_number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, Decimal)):
+        return float(value)
+    return None
+
+
+def _days_until(value, today):
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        try:
+            value = date.fromisoformat(value[:10])
+        except ValueError:
+            return None
+    return (value - today).days if isinstance(value, date) else None
+
+
+def compact_results(rows, token_budget=1500, low_stock=50, expiry_days=7):
+    """
+    Compactar resultados para el prompt de interpretación.
+
+    Renderiza las filas como CSV (una cabecera, sin indentación), precalcula
+    agregados sobre todas las filas (conteo, suma/mín/máx de columnas
+    numéricas, stock bajo y próximos a vencer) y trunca la tabla para que
+    el bloque completo quepa en `token_budget` tokens estimados.
+    """
+    columns = list(rows[0].keys()) if rows else []
+    today = date.today()
+
+    aggregates = {"filas": len(rows)}
+    numeric = {}
+    low_stock_count = 0
+    near_expiry_count = 0
+    for row in rows:
+        for column in columns:
+            number = _as_number(row.get(column))
+            if number is None:
+                continue
+            stats = numeric.setdefault(column, [0.0, number, number])
+            stats[0] += number
+            stats[1] = min(stats[1], number)
+            stats[2] = max(stats[2], number)
+        cantidad = _as_number(row.get('cantidad'))
+        if cantidad is not None and cantidad <= low_stock:
+            low_stock_count += 1
+        dias = row.get('dias_para_vencer')
+        if dias is None and row.get('fecha_caducidad') is not None:
+            dias = _days_until(row['fecha_caducidad'], today)
+        if isinstance(dias, (int, float)) and dias <= expiry_days:
+            near_expiry_count += 1
+
+    for column, (total, minimum, maximum) in numeric.items():
+        if column == 'id' or column.startswith('id_'):
+            continue
+        aggregates[column] = {
+            "suma": round(total, 2), "min": round(minimum, 2), "max": round(maximum, 2)
+        }
+    if 'cantidad' in columns:
+        aggregates[f"stock_menor_o_igual_{low_stock}"] = low_stock_count
+    if 'dias_para_vencer' in columns or 'fecha_caducidad' in columns:
+        aggregates[f"vencen_en_{expiry_days}_dias"] = near_expiry_count
+    summary = json.dumps(aggregates, ensure_ascii=False, separators=(',', ':'), default=str)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    header = buffer.getvalue()
+    used = estimate_tokens(summary) + estimate_tokens(header)
+    lines = [header]
+    included = 0
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow([_compact_value(row.get(column)) for column in columns])
+        line = buffer.getvalue()
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+        included += 1
+
+    table = ''.join(lines)
+    if included < len(rows):
+        table += f"... ({len(rows) - included} filas omitidas; ver RESUMEN para totales)\n"
+    return {
+        "table": table,
+        "summary": summary,
+        "rows_included": included,
+        "rows_total": len(rows),
+        "estimated_tokens": estimate_tokens(table) + estimate_tokens(summary),
+    }
+
+
+INTERPRETATION_PROMPT = """Eres un asistente especializado en inventario de alimentos que interpreta resultados de base de datos.
+
+PREGUNTA ORIGINAL: {question}
+
+RESUMEN (calculado sobre todas las filas): {summary}
+
+RESULTADOS DE LA BASE DE DATOS (CSV, {rows_included} de {rows_total} filas):
+{table}
+INSTRUCCIONES:
+1. Proporciona una respuesta natural y útil en español
+2. Resalta información importante como stock bajo, productos próximos a vencer, etc.
+3. Si no hay resultados, sugiere alternativas o productos similares
+4. Incluye recomendaciones cuando sea apropiado
+5. Usa formato claro con bullet points cuando sea necesario
+6. Sé específico con números y datos encontrados; usa el RESUMEN para totales
+
+RESPUESTA:
+"""
+
+
+class ConnectionPool:
+    """Pool de conexiones reutilizables a la base de datos.
+
+    `connect` es cualquier callable que devuelva una conexión DB-API
+    (mysql.connector, sqlite3, ...), lo que permite probar el pool sin MySQL.
+    """
+
+    def __init__(self, connect, size=5, max_lifetime=3600, timeout=30):
+        self._connect = connect
+        self.size = size
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self._idle = []  # Pila LIFO de conexiones libres
+        self._created_at = {}
+        self._conn_state = {}
+        self._open = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "reconnects": 0,
+            "discarded": 0,
+        }
+
+    def _is_healthy(self, conn):
+        """Verificar que la conexión siga viva antes de entregarla"""
+        try:
+            if hasattr(conn, 'is_connected'):  # mysql.connector hace ping al servidor
+                return conn.is_connected()
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        self._created_at.pop(id(conn), None)
+        self._conn_state.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+            self._stats["created"] += 1
+        return conn
+
+    def state(self, conn):
+        """Diccionario asociado a una conexión mientras viva (p. ej. prepared statements)"""
+        return self._conn_state.setdefault(id(conn), {})
+
+    def acquire(self):
+        """Obtener una conexión del pool, esperando si todas están en uso"""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            self._stats["checkouts"] += 1
+            waited = False
+            while not self._idle and self._open >= self.size:
+                if not waited:
+                    self._stats["waits"] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise TimeoutError(f"No hay conexiones libres tras {self.timeout}s (pool de {self.size})")
+                self._cond.wait(remaining)
+            if self._idle:
+                conn = self._idle.pop()
+            else:
+                conn = None
+                self._open += 1
+
+        try:
+            if conn is None:
+                return self._new_connection()
+
+            age = time.monotonic() - self._created_at.get(id(conn), 0)
+            if self.max_lifetime and age > self.max_lifetime:
+                self._close(conn)
+                with self._cond:
+                    self._stats["recycled"] += 1
+                return self._new_connection()
+
+            if not self._is_healthy(conn):
+                self._close(conn)
+                with self._cond:
+                    self._stats["reconnects"] += 1
+                return self._new_connection()
+
+            return conn
+        except Exception:
+            # No se pudo abrir la conexión: liberar el hueco reservado
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, discard=False):
+        """Devolver una conexión al pool (o descartarla si quedó inservible)"""
+        if not discard:
+            try:
+                # Cerrar la transacción implícita para no leer snapshots viejos
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        if discard:
+            self._close(conn)
+        with self._cond:
+            if discard:
+                self._open -= 1
+                self._stats["discarded"] += 1
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager que entrega una conexión y la devuelve al terminar"""
+        conn = self.acquire()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            discard = not self._is_healthy(conn)
+            raise
+        except BaseException:
+            # GeneratorExit (generador cerrado antes de tiempo), KeyboardInterrupt...:
+            # la conexión puede tener un resultado a medio leer, no se reutiliza
+            discard = True
+            raise
+        finally:
+            self.release(conn, discard=discard)
+
+    def close_all(self):
+        """Cerrar todas las conexiones libres"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Estadísticas del pool para dimensionarlo bajo carga"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+            })
+        return stats
+
+
+class WatermarkCache:
+    """Caché de resultados que se invalida cuando cambia el inventario.
+
+    En lugar de expirar a ciegas, consulta periódicamente una marca de agua
+    barata (MAX(id) de movimientos_inventario y productos, ambas resueltas por
+    la clave primaria) y solo vuelve a ejecutar las consultas pesadas cuando
+    la marca cambia. El TTL queda como red de seguridad para cambios que no
+    pasan por esas tablas.
+    """
+
+    WATERMARK_QUERY = """
+        SELECT (SELECT MAX(id) FROM movimientos_inventario) AS movimientos,
+               (SELECT MAX(id) FROM productos) AS productos
+    """
+
+    def __init__(self, run_query, poll_interval=5, ttl=600,
+                 max_entries=256, max_bytes=16 * 1024 * 1024):
+        self._run_query = run_query
+        self.poll_interval = poll_interval
+        self._cache = LRUCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+        self._watermark = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self._stats = {"polls": 0, "invalidations": 0, "poll_errors": 0}
+
+    def _poll(self):
+        try:
+            rows = self._run_query(self.WATERMARK_QUERY)
+        except Exception as e:
+            rows = f"Error: {e}"
+        if isinstance(rows, str) or not rows:
+            print(f"Warning: No se pudo leer la marca de agua del inventario: {rows}")
+            self._stats["poll_errors"] += 1
+            return self._watermark
+        row = rows[0]
+        return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+    def check(self):
+        """Consultar la marca de agua (como mucho cada poll_interval segundos)"""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked_at is not None and now - self._checked_at < self.poll_interval:
+                return self._watermark
+            self._checked_at = now
+            self._stats["polls"] += 1
+            watermark = self._poll()
+            if watermark != self._watermark:
+                if self._watermark is not None:
+                    self._stats["invalidations"] += 1
+                self._cache.clear()
+                self._watermark = watermark
+            return self._watermark
+
+    def fetch(self, query, params=None):
+        """Devolver resultados cacheados o ejecutar la consulta si el inventario cambió"""
+        self.check()
+        key = (query, tuple(params) if params else None)
+        results = self._cache.get(key)
+        if results is not None:
+            return results
+        results = self._run_query(query, params) if params else self._run_query(query)
+        if not isinstance(results, str):  # No cachear errores
+            self._cache.set(key, results)
+        return results
+
+    def invalidate(self):
+        """Forzar una nueva lectura en la próxima consulta"""
+        with self._lock:
+            self._cache.clear()
+            self._checked_at = None
+
+    def stats(self):
+        stats = self._cache.stats()
+        with self._lock:
+            stats.update(self._stats)
+            stats["watermark"] = self._watermark
+        return stats
+
+
+class WatermarkIndex:
+    """Base de los índices en memoria que se mantienen al día con la marca de agua.
+
+    El índice se refresca con la misma marca de agua que WatermarkCache:
+    cuando cambia, solo se vuelven a leer los productos nuevos o con
+    movimientos posteriores a la última marca. Cada `rebuild_interval`
+    segundos se reconstruye completo para recoger cambios que no pasan por
+    movimientos (ediciones o borrados). Las subclases definen SNAPSHOT_QUERY,
+    `_load(filas)` y `_apply(fila)`.
+    """
+
+    SNAPSHOT_QUERY = None
+    CHANGES_FILTER = """
+        WHERE p.id > %s
+           OR p.id IN (SELECT id_producto FROM movimientos_inventario WHERE id > %s)
+    """
+    LABEL = "índice"
+
+    def __init__(self, run_query, poll_interval=5, rebuild_interval=600):
+        self._run_query = run_query
+        self.poll_interval = poll_interval
+        self.rebuild_interval = rebuild_interval
+        self._watermark = None
+        self._checked_at = None
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._stats = {"rebuilds": 0, "incremental_updates": 0, "products_updated": 0, "errors": 0}
+
+    def _fetch(self, query, params=None):
+        rows = self._run_query(query, params) if params else self._run_query(query)
+        if isinstance(rows, str):
+            raise RuntimeError(rows)
+        if getattr(rows, "truncated", False):
+            raise RuntimeError("El resultado se truncó; el índice quedaría incompleto")
+        return rows
+
+    def _watermark_now(self):
+        row = self._fetch(WatermarkCache.WATERMARK_QUERY)[0]
+        return tuple(row.values()) if isinstance(row, dict) else tuple(row)
+
+    def _load(self, rows):
+        raise NotImplementedError
+
+    def _apply(self, row):
+        raise NotImplementedError
+
+    def _rebuild(self):
+        self._load([dict(row) for row in self._fetch(self.SNAPSHOT_QUERY)])
+        self._built_at = time.monotonic()
+        self._stats["rebuilds"] += 1
+
+    def _update(self):
+        last_movement, last_product = (value or 0 for value in self._watermark)
+        changed = self._fetch(self.SNAPSHOT_QUERY + self.CHANGES_FILTER, (last_product, last_movement))
+        for row in changed:
+            self._apply(dict(row))
+        self._stats["incremental_updates"] += 1
+        self._stats["products_updated"] += len(changed)
+
+    def refresh(self, force=False):
+        """Poner el índice al día (como mucho cada poll_interval segundos)"""
+        with self._lock:
+            now = time.monotonic()
+            # Sin índice construido se reintenta siempre (un fallo no deja un índice vacío)
+            if (not force and self._built_at is not None
+                    and now - self._checked_at < self.poll_interval):
+                return
+            self._checked_at = now
+            try:
+                watermark = self._watermark_now()
+                if (force or self._built_at is None or self._watermark is None
+                        or now - self._built_at >= self.rebuild_interval):
+                    self._rebuild()
+                elif watermark != self._watermark:
+                    self._update()
+                self._watermark = watermark
+            except Exception as e:
+                self._stats["errors"] += 1
+                if self._built_at is None:
+                    raise
+                print(f"Warning: No se pudo actualizar el {self.LABEL}: {e}")
+
+    def invalidate(self):
+        """Forzar una reconstrucción completa en la próxima consulta"""
+        with self._lock:
+            self._built_at = None
+            self._checked_at = None
+
+
+class StockIndex(WatermarkIndex):
+    """Índice en memoria de productos ordenado por cantidad y por fecha de caducidad.
+
+    Cualquier consulta por umbral ("cantidad <= n", "vence antes de f") es una
+    búsqueda binaria más un slice, sin volver a MySQL.
+    """
+
+    SNAPSHOT_QUERY = """
+        SELECT p.id, p.nombre, p.cantidad, p.precio_venta,
+               c.nombre AS categoria, pr.nombre AS proveedor, p.fecha_caducidad
+        FROM productos p
+        LEFT JOIN categorias c ON p.id_categoria = c.id
+        LEFT JOIN proveedores pr ON p.id_proveedor = pr.id
+    """
+    LABEL = "índice de stock"
+
+    def __init__(self, run_query, poll_interval=5, rebuild_interval=600):
+        super().__init__(run_query, poll_interval, rebuild_interval)
+        self._products = {}
+        self._by_quantity = []  # claves (cantidad, id) ordenadas
+        self._by_expiry = []  # claves (fecha_caducidad, id) ordenadas, sin nulos
+
+    def _remove(self, product_id):
+        old = self._products.pop(product_id, None)
+        if old is None:
+            return
+        key = (old["cantidad"] or 0, product_id)
+        i = bisect.bisect_left(self._by_quantity, key)
+        if i < len(self._by_quantity) and self._by_quantity[i] == key:
+            del self._by_quantity[i]
+        if old["fecha_caducidad"] is not None:
+            key = (old["fecha_caducidad"], product_id)
+            i = bisect.bisect_left(self._by_expiry, key)
+            if i < len(self._by_expiry) and self._by_expiry[i] == key:
+                del self._by_expiry[i]
+
+    def _apply(self, product):
+        product_id = product["id"]
+        self._remove(product_id)
+        self._products[product_id] = product
+        bisect.insort(self._by_quantity, (product["cantidad"] or 0, product_id))
+        if product["fecha_caducidad"] is not None:
+            bisect.insort(self._by_expiry, (product["fecha_caducidad"], product_id))
+
+    def _load(self, products):
+        self._products = {product["id"]: product for product in products}
+        self._by_quantity = sorted((p["cantidad"] or 0, p["id"]) for p in products)
+        self._by_expiry = sorted(
+            (p["fecha_caducidad"], p["id"]) for p in products if p["fecha_caducidad"] is not None
+        )
+
+    def below(self, threshold, limit=None):
+        """Productos con cantidad <= threshold, de menor a mayor cantidad"""
+        self.refresh()
+        with self._lock:
+            end = bisect.bisect_right(self._by_quantity, (threshold, float("inf")))
+            if limit is not None:
+                end = min(end, limit)
+            return [self._products[product_id] for _, product_id in self._by_quantity[:end]]
+
+    def expiring_before(self, until, limit=None):
+        """Productos con fecha_caducidad <= until, de la más próxima a la más lejana"""
+        self.refresh()
+        with self._lock:
+            end = bisect.bisect_right(self._by_expiry, (until, float("inf")))
+            if limit is not None:
+                end = min(end, limit)
+            return [self._products[product_id] for _, product_id in self._by_expiry[:end]]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, products=len(self._products), watermark=self._watermark)
+
+
+class InventorySummary(WatermarkIndex):
+    """Resúmenes materializados por categoría y por proveedor.
+
+    Por cada grupo se mantienen la cantidad de productos, las unidades, el
+    valor del inventario y las fechas de caducidad ordenadas. Cada producto
+    que cambia (nuevo o con movimientos) resta su aporte anterior y suma el
+    nuevo, así que leer un resumen cuesta O(grupos) sin importar el tamaño
+    del catálogo. `check_consistency` lo compara con un GROUP BY completo.
+    """
+
+    SNAPSHOT_QUERY = """
+        SELECT p.id, p.id_categoria, p.id_proveedor, p.cantidad, p.precio_venta, p.fecha_caducidad
+        FROM productos p
+    """
+    LABEL = "resumen de inventario"
+    GROUPS = {
+        # grupo: (tabla, columna de productos)
+        "categoria": ("categorias", "id_categoria"),
+        "proveedor": ("proveedores", "id_proveedor"),
+    }
+    CHECK_QUERY = """
+        SELECT g.id, COUNT(p.id) AS total_productos,
+               COALESCE(SUM(p.cantidad), 0) AS total_unidades,
+               COALESCE(SUM(p.cantidad * p.precio_venta), 0) AS valor_inventario,
+               COALESCE(SUM(CASE WHEN p.fecha_caducidad <= %s THEN 1 ELSE 0 END), 0) AS por_vencer
+        FROM {table} g
+        LEFT JOIN productos p ON g.id = p.{column}
+        GROUP BY g.id
+    """
+    _EMPTY = {"productos": 0, "unidades": 0, "valor": Decimal(0), "fechas": ()}
+
+    def __init__(self, run_query, poll_interval=5, rebuild_interval=600):
+        super().__init__(run_query, poll_interval, rebuild_interval)
+        self._products = {}  # id -> aporte (categoría, proveedor, unidades, valor, caducidad)
+        self._names = {group: {} for group in self.GROUPS}  # id del grupo -> nombre
+        self._totals = {group: {} for group in self.GROUPS}  # id del grupo -> totales
+        self._stats.update({"checks": 0, "inconsistencies": 0})
+
+    @staticmethod
+    def _contribution(product):
+        cantidad = product["cantidad"] or 0
+        valor = Decimal(str(product["precio_venta"] or 0)) * cantidad
+        return {
+            "categoria": product["id_categoria"],
+            "proveedor": product["id_proveedor"],
+            "unidades": cantidad,
+            "valor": valor,
+            "fecha": product["fecha_caducidad"],
+        }
+
+    def _add(self, contribution, sign, keep_sorted=True):
+        for group in self.GROUPS:
+            group_id = contribution[group]
+            if group_id is None:
+                continue
+            totals = self._totals[group].get(group_id)
+            if totals is None:
+                totals = self._totals[group][group_id] = {**self._EMPTY, "fechas": []}
+            totals["productos"] += sign
+            totals["unidades"] += sign * contribution["unidades"]
+            totals["valor"] += sign * contribution["valor"]
+            fecha = contribution["fecha"]
+            if fecha is None:
+                continue
+            if sign > 0 and not keep_sorted:
+                totals["fechas"].append(fecha)  # _load ordena al final
+            elif sign > 0:
+                bisect.insort(totals["fechas"], fecha)
+            else:
+                i = bisect.bisect_left(totals["fechas"], fecha)
+                if i < len(totals["fechas"]) and totals["fechas"][i] == fecha:
+                    del totals["fechas"][i]
+
+    def _load_names(self):
+        for group, (table, _) in self.GROUPS.items():
+            rows = self._fetch(f"SELECT id, nombre FROM {table}")
+            self._names[group] = {
+                values[0]: values[1]
+                for values in (tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in rows)
+            }
+
+    def _load(self, products):
+        self._load_names()
+        self._products = {}
+        self._totals = {group: {} for group in self.GROUPS}
+        for product in products:
+            contribution = self._contribution(product)
+            self._products[product["id"]] = contribution
+            self._add(contribution, 1, keep_sorted=False)
+        for totals in self._totals.values():
+            for group_totals in totals.values():
+                group_totals["fechas"].sort()
+
+    def _apply(self, product):
+        old = self._products.get(product["id"])
+        if old is not None:
+            self._add(old, -1)
+        contribution = self._contribution(product)
+        self._products[product["id"]] = contribution
+        self._add(contribution, 1)
+
+    def _update(self):
+        super()._update()
+        # Un producto nuevo puede traer una categoría o un proveedor nuevos
+        if any(group_id not in self._names[group]
+               for group in self.GROUPS for group_id in self._totals[group]):
+            self._load_names()
+
+    def rows(self, group, days=7):
+        """
+        Resumen de `group` ("categoria" o "proveedor") como ResultSet con las
+        mismas columnas que las consultas del catálogo más el valor del
+        inventario y los productos que vencen en `days` días.
+        """
+        if group not in self.GROUPS:
+            raise ValueError(f"Grupo desconocido: {group}")
+        self.refresh()
+        until = date.today() + timedelta(days=days)
+        with self._lock:
+            totals = self._totals[group]
+            rows = []
+            for group_id, name in self._names[group].items():
+                t = totals.get(group_id, self._EMPTY)
+                rows.append((
+                    name,
+                    t["productos"],
+                    # SUM() de MySQL sin productos es NULL
+                    t["unidades"] if t["productos"] else None,
+                    t["valor"] if t["productos"] else None,
+                    bisect.bisect_right(t["fechas"], until),
+                ))
+        rows.sort(key=lambda row: (-row[1], row[0] or ""))
+        return ResultSet((group, "total_productos", "total_unidades", "valor_inventario", "por_vencer"), rows)
+
+    def check_consistency(self, days=7, repair=True):
+        """
+        Comparar los resúmenes en memoria con un GROUP BY completo en MySQL.
+        Devuelve la lista de diferencias; con `repair` se reconstruye si hay alguna.
+        """
+        self.refresh()
+        until = date.today() + timedelta(days=days)
+        differences = []
+        for group, (table, column_name) in self.GROUPS.items():
+            expected = self._fetch(self.CHECK_QUERY.format(table=table, column=column_name), (until,))
+            with self._lock:
+                totals = self._totals[group]
+                for row in expected:
+                    group_id, productos, unidades, valor, por_vencer = (
+                        tuple(row.values()) if isinstance(row, dict) else tuple(row)
+                    )
+                    t = totals.get(group_id, self._EMPTY)
+                    actual = {
+                        "total_productos": t["productos"],
+                        "total_unidades": t["unidades"],
+                        "valor_inventario": t["valor"],
+                        "por_vencer": bisect.bisect_right(t["fechas"], until),
+                    }
+                    recomputed = {
+                        "total_productos": productos,
+                        "total_unidades": unidades,
+                        "valor_inventario": valor,
+                        "por_vencer": por_vencer,
+                    }
+                    for field, value in recomputed.items():
+                        if abs(Decimal(str(value or 0)) - Decimal(str(actual[field]))) > Decimal("0.01"):
+                            differences.append({
+                                "grupo": group, "id": group_id, "campo": field,
+                                "memoria": actual[field], "recalculado": value,
+                            })
+        with self._lock:
+            self._stats["checks"] += 1
+            self._stats["inconsistencies"] += len(differences)
+        if differences:
+            print(f"Warning: {len(differences)} diferencias entre el resumen de inventario y MySQL")
+            if repair:
+                self.invalidate()
+        return differences
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                products=len(self._products),
+                categories=len(self._names["categoria"]),
+                providers=len(self._names["proveedor"]),
+                watermark=self._watermark,
+            )
+
+
+# --- CATÁLOGO DE CONSULTAS ---
+# Consultas predefinidas con nombre y parámetros. Se ejecutan como prepared
+# statements del servidor, de modo que MySQL reutiliza el plan y los límites
+# se ajustan cambiando parámetros en lugar de reconstruir el SQL.
+QUERY_CATALOG = {
+    "stock": {
+        "sql": """
+            SELECT p.id, p.nombre, p.cantidad, p.precio_venta, 
+                   c.nombre as categoria, pr.nombre as proveedor, 
+                   p.fecha_caducidad
+            FROM productos p 
+            LEFT JOIN categorias c ON p.id_categoria = c.id 
+            LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
+            WHERE p.cantidad > 0
+            ORDER BY p.nombre 
+            LIMIT %s
+        """,
+        "params": {"limite": 50},
+    },
+    "stock_bajo": {
+        "sql": """
+            SELECT p.id, p.nombre, p.cantidad, p.precio_venta, 
+                   c.nombre as categoria, pr.nombre as proveedor
+            FROM productos p 
+            LEFT JOIN categorias c ON p.id_categoria = c.id 
+            LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
+            WHERE p.cantidad <= %s
+            ORDER BY p.cantidad ASC 
+            LIMIT %s
+        """,
+        "params": {"umbral": 50, "limite": 50},
+    },
+    "vencimiento": {
+        "sql": """
+            SELECT p.id, p.nombre, p.cantidad, p.fecha_caducidad, 
+                   c.nombre as categoria, pr.nombre as proveedor,
+                   DATEDIFF(p.fecha_caducidad, CURDATE()) as dias_para_vencer
+            FROM productos p 
+            LEFT JOIN categorias c ON p.id_categoria = c.id 
+            LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
+            WHERE p.fecha_caducidad <= DATE_ADD(CURDATE(), INTERVAL %s DAY)
+            ORDER BY p.fecha_caducidad ASC 
+            LIMIT %s
+        """,
+        "params": {"dias": 30, "limite": 50},
+    },
+    "proveedores": {
+        "sql": """
+            SELECT pr.nombre as proveedor, 
+                   COUNT(p.id) as total_productos,
+                   SUM(p.cantidad) as total_unidades
+            FROM proveedores pr 
+            LEFT JOIN productos p ON pr.id = p.id_proveedor 
+            GROUP BY pr.id, pr.nombre
+            ORDER BY total_productos DESC
+        """,
+        "params": {},
+    },
+    "categorias": {
+        "sql": """
+            SELECT c.nombre as categoria, 
+                   COUNT(p.id) as total_productos,
+                   SUM(p.cantidad) as total_unidades
+            FROM categorias c 
+            LEFT JOIN productos p ON c.id = p.id_categoria 
+            GROUP BY c.id, c.nombre
+            ORDER BY total_productos DESC
+        """,
+        "params": {},
+    },
+    "mas_caros": {
+        "sql": """
+            SELECT p.nombre, p.precio_venta, p.cantidad, 
+                   c.nombre as categoria, pr.nombre as proveedor
+            FROM productos p 
+            LEFT JOIN categorias c ON p.id_categoria = c.id 
+            LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
+            ORDER BY p.precio_venta DESC 
+            LIMIT %s
+        """,
+        "params": {"n": 10},
+    },
+    "sugerencias": {
+        "sql": """
+            SELECT DISTINCT nombre 
+            FROM productos 
+            WHERE cantidad > 0 
+            ORDER BY nombre 
+            LIMIT %s
+        """,
+        "params": {"limite": 20},
+    },
+    "alerta_stock_bajo": {
+        "sql": """
+            SELECT p.nombre, p.cantidad, c.nombre as categoria 
+            FROM productos p 
+            LEFT JOIN categorias c ON p.id_categoria = c.id 
+            WHERE p.cantidad <= %s 
+            ORDER BY p.cantidad ASC
+        """,
+        "params": {"umbral": 50},
+    },
+    # Historial de movimientos paginado por keyset (más recientes primero)
+    "movimientos": {
+        "sql": """
+            SELECT m.id, p.nombre AS producto, m.tipo_movimiento, 
+                   m.cantidad, m.fecha, m.descripcion
+            FROM movimientos_inventario m
+            JOIN productos p ON m.id_producto = p.id
+            ORDER BY m.fecha DESC, m.id DESC
+            LIMIT %s
+        """,
+        "params": {"limite": 200},
+    },
+    "movimientos_siguientes": {
+        "sql": """
+            SELECT m.id, p.nombre AS producto, m.tipo_movimiento, 
+                   m.cantidad, m.fecha, m.descripcion
+            FROM movimientos_inventario m
+            JOIN productos p ON m.id_producto = p.id
+            WHERE m.fecha < %s OR (m.fecha = %s AND m.id < %s)
+            ORDER BY m.fecha DESC, m.id DESC
+            LIMIT %s
+        """,
+        "params": {"fecha": None, "fecha_igual": None, "id": None, "limite": 200},
+    },
+}
+
+# SQL de las consultas catalogadas (se ejecutan como prepared statements)
+PREPARED_SQL = {spec["sql"] for spec in QUERY_CATALOG.values()}
+
+# Consultas de distribución que se responden desde InventorySummary (SQL -> grupo)
+SUMMARY_SQL = {
+    QUERY_CATALOG["categorias"]["sql"]: "categoria",
+    QUERY_CATALOG["proveedores"]["sql"]: "proveedor",
+}
+
+
+# Plantillas de las líneas de _basic_interpretation (str.format ya ligado)
+LOW_STOCK_LINE = "{} **{}**: {} unidades".format
+EXPIRY_LINE = "{} **{}**: Vence {}".format
+PROVIDER_LINE = "🏦 **{}**: {} productos, {} unidades totales".format
+CATEGORY_LINE = "🏷️ **{}**: {} productos, {} unidades totales".format
+PRICEY_LINE = "{}. **{}**: ${} ({} unidades) - {}".format
+FEATURED_LINE = "• **{}**: {} unidades (${}) - {}".format
+
+# --- ESTRATEGIAS DE RESPUESTA ---
+# Cómo se redacta la respuesta según la intención de la pregunta:
+#   "template":     respuesta inmediata con plantilla (_basic_interpretation), sin Gemini
+#   "template+llm": respuesta inmediata con plantilla y enriquecimiento de Gemini en segundo plano
+#   "llm":          interpretación con Gemini (plantilla solo si Gemini falla)
+# La clave None corresponde a preguntas sin intención conocida (SQL generado por Gemini).
+RESPONSE_POLICY = {
+    "stock": "template",
+    "stock_bajo": "template",
+    "vencimiento": "template",
+    "proveedores": "template",
+    "categorias": "template",
+    "mas_caros": "template",
+    None: "llm",
+}
+RESPONSE_STRATEGIES = ("template", "template+llm", "llm")
+
+
+def build_query(name, **overrides):
+    """Obtener (sql, parámetros) de una consulta del catálogo"""
+    spec = QUERY_CATALOG[name]
+    unknown = set(overrides) - set(spec["params"])
+    if unknown:
+        raise ValueError(f"Parámetros desconocidos para '{name}': {', '.join(sorted(unknown))}")
+    params = {**spec["params"], **overrides}
+    return spec["sql"], tuple(params[key] for key in spec["params"])
+
 
 class DatabaseAgent:
-    def __init__(self):
-        # Cargar variables de entorno
-        load_dotenv()
+    def __init__(self, pool_size=None, pool_max_lifetime=None, response_policy=None):
+        # Cargar variables de entorno (una sola vez por proceso)
+        registry.load_env()
         
-        # Configurar Gemini
-        genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
-        self.model = genai.GenerativeModel('gemini-1.5-pro')
+        # Gemini se configura en el primer uso (ver la propiedad `model`)
+        self._model = None
         
         # Configurar conexión a base de datos
         self.db_config = self._load_db_config()
+        self.pool = ConnectionPool(
+            self._connect_db,
+            size=pool_size or int(os.getenv('DB_POOL_SIZE', 5)),
+            max_lifetime=pool_max_lifetime or int(os.getenv('DB_POOL_MAX_LIFETIME', 3600)),
+        )
+
+        # Cachés en capas: pregunta -> SQL, SQL -> resultados, (SQL, resultados) -> interpretación
+        self.sql_cache = LRUCache(max_entries=1024, max_bytes=1024 * 1024)
+        self.result_cache = WatermarkCache(
+            self._execute_query,
+            poll_interval=int(os.getenv('WATERMARK_POLL_INTERVAL', 5)),
+            ttl=int(os.getenv('RESULT_CACHE_TTL', 600)),
+        )
+        self.interpretation_cache = LRUCache(max_entries=512, max_bytes=4 * 1024 * 1024)
+        # Índice de productos por cantidad y caducidad para las alertas (sin límite de filas)
+        self.stock_index = StockIndex(
+            lambda query, params=None: self._execute_query(query, params, capped=False),
+            poll_interval=int(os.getenv('WATERMARK_POLL_INTERVAL', 5)),
+        )
+        # Resúmenes por categoría y proveedor mantenidos con los movimientos
+        self.inventory_summary = InventorySummary(
+            lambda query, params=None: self._execute_query(query, params, capped=False),
+            poll_interval=int(os.getenv('WATERMARK_POLL_INTERVAL', 5)),
+        )
+        
+        # Presupuesto de tokens para los resultados enviados a Gemini al interpretar
+        self.prompt_token_budget = int(os.getenv('PROMPT_TOKEN_BUDGET', 1500))
+        
+        # Límites del SQL generado por Gemini: filas devueltas, tiempo máximo en el
+        # servidor (ms) y filas examinadas estimadas con EXPLAIN (0 no ejecuta EXPLAIN)
+        self.sql_max_rows = int(os.getenv('SQL_MAX_ROWS', 50))
+        self.sql_timeout_ms = int(os.getenv('SQL_TIMEOUT_MS', 5000))
+        self.sql_max_examined_rows = int(os.getenv('SQL_MAX_EXAMINED_ROWS', 100000))
+        
+        # Lectura de resultados por lotes con límites de filas y bytes por consulta
+        self.fetch_batch_size = int(os.getenv('FETCH_BATCH_SIZE', 500))
+        self.result_max_rows = int(os.getenv('RESULT_MAX_ROWS', 5000))
+        self.result_max_bytes = int(os.getenv('RESULT_MAX_BYTES', 8 * 1024 * 1024))
+        
+        # Estrategia de respuesta por intención y workers para el enriquecimiento con Gemini
+        self.response_policy = {**RESPONSE_POLICY, **(response_policy or {})}
+        invalid = set(self.response_policy.values()) - set(RESPONSE_STRATEGIES)
+        if invalid:
+            raise ValueError(f"Estrategias de respuesta desconocidas: {', '.join(sorted(invalid))}")
+        self._enrichment_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('ENRICHMENT_WORKERS', 4)),
+            thread_name_prefix='enrichment',
+        )
+        
+        # Especulación: para preguntas ambiguas se ejecuta la consulta predefinida más
+        # probable mientras Gemini genera el SQL; si Gemini tarda más de este plazo
+        # (segundos) se responde con la especulación. 0 la desactiva.
+        self.speculation_deadline = float(os.getenv('SPECULATION_DEADLINE', 1.5))
+        
+        # Memoria pregunta -> SQL generado: se crea en el primer uso (importa numpy)
+        self._query_memory = None
+        self._query_memory_lock = threading.Lock()
+        self._speculation_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('SPECULATION_WORKERS', 8)),
+            thread_name_prefix='speculation',
+        )
         
         # Schema de la base de datos para el contexto del agente
         self.db_schema = """
@@ -49,114 +1033,208 @@ class DatabaseAgent:
         - descripcion (TEXT)
         """
     
+    @property
+    def model(self):
+        """Modelo de Gemini compartido (rate limiting, reintentos y cortacircuitos)"""
+        if self._model is None:
+            self._model = registry.get_gemini_model('gemini-1.5-pro')
+        return self._model
+    
+    @model.setter
+    def model(self, model):
+        self._model = model
+    
+    @property
+    def query_memory(self):
+        """Preguntas ya resueltas por Gemini con su SQL, buscadas por similitud"""
+        with self._query_memory_lock:
+            if self._query_memory is None:
+                from query_memory import DEFAULT_PATH, EMBEDDERS, QueryMemory, resolve_path
+                
+                embedder = EMBEDDERS[os.getenv('QUERY_EMBEDDER', 'hash')]()
+                self._query_memory = QueryMemory(
+                    embedder,
+                    path=resolve_path(os.getenv('QUERY_MEMORY_PATH', DEFAULT_PATH)),
+                    threshold=float(os.getenv('QUERY_MEMORY_THRESHOLD', 0.9)),
+                )
+            return self._query_memory
+    
+    @query_memory.setter
+    def query_memory(self, memory):
+        self._query_memory = memory
+    
     def _load_db_config(self):
         """Cargar configuración de base de datos"""
-        try:
-            secrets_path = '.streamlit/secrets.toml'
-            with open(secrets_path, 'r') as f:
-                secrets = toml.load(f)
-            return secrets['connections']['mysql']
-        except Exception as e:
-            raise Exception(f"Error cargando configuración de BD: {e}")
+        return registry.get_db_config()
     
     def _connect_db(self):
         """Crear conexión a la base de datos"""
         return mysql.connector.connect(**self.db_config)
     
-    def _execute_query(self, query, params=None):
-        """Ejecutar consulta en la base de datos"""
+    def _prepared_cursor(self, conn, query):
+        """Cursor con el prepared statement de `query`, reutilizado por conexión"""
+        cursors = self.pool.state(conn).setdefault('prepared', {})
+        cursor = cursors.get(query)
+        if cursor is None:
+            cursor = conn.cursor(prepared=True)
+            cursors[query] = cursor
+        return cursor
+
+    def _fetch(self, cursor, capped=True):
+        if not capped:
+            return fetch_result(cursor, self.fetch_batch_size)
+        return fetch_result(cursor, self.fetch_batch_size, self.result_max_rows, self.result_max_bytes)
+
+    def _execute_query(self, query, params=None, capped=True):
+        """Ejecutar consulta en la base de datos (ResultSet acotado por filas y bytes)"""
         try:
-            conn = self._connect_db()
-            cursor = conn.cursor(dictionary=True)
-            cursor.execute(query, params or ())
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
-            return results
+            with self.pool.connection() as conn:
+                if query in PREPARED_SQL:
+                    cursor = self._prepared_cursor(conn, query)
+                    try:
+                        cursor.execute(query, params or ())
+                        return self._fetch(cursor, capped)
+                    except Exception:
+                        # El statement pudo quedar inservible: cerrarlo (libera el statement
+                        # del servidor, limitado por max_prepared_stmt_count) y prepararlo
+                        # de nuevo la próxima vez
+                        stale = self.pool.state(conn)['prepared'].pop(query, None)
+                        if stale is not None:
+                            try:
+                                stale.close()
+                            except Exception:
+                                pass
+                        raise
+
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(query, params or ())
+                    return self._fetch(cursor, capped)
+                finally:
+                    cursor.close()
         except Exception as e:
             return f"Error ejecutando consulta: {e}"
-    
-    def _generate_sql_query(self, user_question):
-        """Generar consulta SQL usando Gemini o consultas predefinidas"""
-        
-        # Diccionario de consultas predefinidas para casos comunes
-        predefined_queries = {
-            "stock": """
-                SELECT p.id, p.nombre, p.cantidad, p.precio_venta, 
-                       c.nombre as categoria, pr.nombre as proveedor, 
-                       p.fecha_caducidad
-                FROM productos p 
-                LEFT JOIN categorias c ON p.id_categoria = c.id 
-                LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
-                WHERE p.cantidad > 0
-                ORDER BY p.nombre 
-                LIMIT 50
-            """,
-            "stock_bajo": """
-                SELECT p.id, p.nombre, p.cantidad, p.precio_venta, 
-                       c.nombre as categoria, pr.nombre as proveedor
-                FROM productos p 
-                LEFT JOIN categorias c ON p.id_categoria = c.id 
-                LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
-                WHERE p.cantidad <= 50
-                ORDER BY p.cantidad ASC 
-                LIMIT 50
-            """,
-            "vencimiento": """
-                SELECT p.id, p.nombre, p.cantidad, p.fecha_caducidad, 
-                       c.nombre as categoria, pr.nombre as proveedor,
-                       DATEDIFF(p.fecha_caducidad, CURDATE()) as dias_para_vencer
-                FROM productos p 
-                LEFT JOIN categorias c ON p.id_categoria = c.id 
-                LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
-                WHERE p.fecha_caducidad <= DATE_ADD(CURDATE(), INTERVAL 30 DAY)
-                ORDER BY p.fecha_caducidad ASC 
-                LIMIT 50
-            """,
-            "proveedores": """
-                SELECT pr.nombre as proveedor, 
-                       COUNT(p.id) as total_productos,
-                       SUM(p.cantidad) as total_unidades
-                FROM proveedores pr 
-                LEFT JOIN productos p ON pr.id = p.id_proveedor 
-                GROUP BY pr.id, pr.nombre
-                ORDER BY total_productos DESC
-            """,
-            "categorias": """
-                SELECT c.nombre as categoria, 
-                       COUNT(p.id) as total_productos,
-                       SUM(p.cantidad) as total_unidades
-                FROM categorias c 
-                LEFT JOIN productos p ON c.id = p.id_categoria 
-                GROUP BY c.id, c.nombre
-                ORDER BY total_productos DESC
-            """,
-            "mas_caros": """
-                SELECT p.nombre, p.precio_venta, p.cantidad, 
-                       c.nombre as categoria, pr.nombre as proveedor
-                FROM productos p 
-                LEFT JOIN categorias c ON p.id_categoria = c.id 
-                LEFT JOIN proveedores pr ON p.id_proveedor = pr.id 
-                ORDER BY p.precio_venta DESC 
-                LIMIT 10
-            """
+
+    def stream_query(self, query, params=None, max_rows=None, max_bytes=None):
+        """
+        Generador de (columnas, lote de tuplas) para recorrer resultados grandes
+        (exportaciones, reportes) sin tenerlos completos en memoria. La conexión
+        del pool queda tomada hasta agotar o cerrar el generador.
+        """
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params or ())
+                columns = column_names(cursor)
+                batch = []
+                for row in stream_rows(cursor, self.fetch_batch_size, max_rows, max_bytes):
+                    batch.append(row)
+                    if len(batch) >= self.fetch_batch_size:
+                        yield columns, batch
+                        batch = []
+                if batch:
+                    yield columns, batch
+            finally:
+                # Si el generador se cerró antes de agotarse, el cursor sin buffer
+                # tiene filas pendientes y close() puede fallar; el pool descarta
+                # esa conexión de todos modos
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+    def get_pool_stats(self):
+        """Estadísticas del pool de conexiones (checkouts, esperas, abiertas)"""
+        return self.pool.stats()
+
+    def get_llm_stats(self):
+        """Métricas de las llamadas a Gemini (reintentos, rechazos, estado del circuito)"""
+        if self._model is None:
+            return {}
+        return self._model.stats() if hasattr(self._model, 'stats') else {}
+
+    def get_cache_stats(self):
+        """Aciertos/fallos de cada capa de caché"""
+        return {
+            "sql": self.sql_cache.stats(),
+            "results": self.result_cache.stats(),
+            "interpretation": self.interpretation_cache.stats(),
+            "stock_index": self.stock_index.stats(),
+            "inventory_summary": self.inventory_summary.stats(),
+            "query_memory": self._query_memory.stats() if self._query_memory else {},
         }
+
+    def clear_caches(self):
+        """Vaciar todas las cachés del agente"""
+        self.sql_cache.clear()
+        self.result_cache.invalidate()
+        self.interpretation_cache.clear()
+        self.stock_index.invalidate()
+        self.inventory_summary.invalidate()
+
+    def explain_queries(self):
+        """EXPLAIN de las consultas del catálogo y de las generadas por Gemini"""
+        from migrations import catalog_queries, explain_queries
+        
+        queries = catalog_queries()
+        for i, sql in enumerate(self.sql_cache.values(), 1):
+            queries[f"gemini_{i}"] = (sql, None)
+        with self.pool.connection() as conn:
+            return explain_queries(conn, queries)
+
+    def _guard_generated_sql(self, sql_query):
+        """
+        Validar el SQL de Gemini antes de ejecutarlo: solo SELECT, LIMIT acotado,
+        joins con condición, tiempo máximo y costo estimado con EXPLAIN.
+        Lanza UnsafeQueryError si la consulta no debe ejecutarse.
+        """
+        sql_query = guard_sql(sql_query, max_limit=self.sql_max_rows, timeout_ms=self.sql_timeout_ms)
+        if self.sql_max_examined_rows:
+            from migrations import explain_query
+            
+            with self.pool.connection() as conn:
+                result = explain_query(conn, sql_query)
+            if result["error"]:
+                raise UnsafeQueryError(f"EXPLAIN falló: {result['error']}")
+            examined = estimate_examined_rows(result["plan"])
+            if examined > self.sql_max_examined_rows:
+                raise UnsafeQueryError(
+                    f"Examinaría ~{examined} filas (máximo {self.sql_max_examined_rows})"
+                )
+        return sql_query
+
+    def _execute_cached_query(self, query, params=None):
+        """Ejecutar una consulta reutilizando resultados mientras el inventario no cambie"""
+        group = SUMMARY_SQL.get(query)
+        if group is not None:
+            try:
+                return self.inventory_summary.rows(group)
+            except Exception as e:
+                print(f"Warning: Resumen de inventario no disponible, consultando MySQL: {e}")
+        return self.result_cache.fetch(query, params)
+    
+    def _generate_sql_query(self, user_question, intent=None):
+        """Generar (consulta SQL, parámetros) usando el catálogo o Gemini"""
+        cache_key = normalize_question(user_question)
+        cached_sql = self.sql_cache.get(cache_key)
+        if cached_sql is not None:
+            return cached_sql, None
         
         # Determinar qué consulta usar basado en palabras clave
-        question_lower = user_question.lower()
-        
-        if any(word in question_lower for word in ["stock bajo", "poco stock", "stock menor", "bajo stock"]):
-            return predefined_queries["stock_bajo"]
-        elif any(word in question_lower for word in ["vencen", "caducan", "expiran", "vencimiento"]):
-            return predefined_queries["vencimiento"]
-        elif any(word in question_lower for word in ["proveedor", "proveedores"]):
-            return predefined_queries["proveedores"]
-        elif any(word in question_lower for word in ["categoria", "categorías", "categorias"]):
-            return predefined_queries["categorias"]
-        elif any(word in question_lower for word in ["caros", "caro", "precio alto", "más caros"]):
-            return predefined_queries["mas_caros"]
-        elif any(word in question_lower for word in ["stock", "productos", "inventario", "tengo"]):
-            return predefined_queries["stock"]
+        if intent is None:
+            intent = AGENT_ROUTER.classify(user_question)
+        if intent in QUERY_CATALOG:
+            return build_query(intent)
+        
+        # Una pregunta casi igual a otra ya resuelta reutiliza su SQL (ya validado)
+        try:
+            remembered = self.query_memory.lookup(user_question)
+        except Exception as e:
+            print(f"Warning: No se pudo consultar la memoria de consultas: {e}")
+            remembered = None
+        if remembered is not None:
+            self.sql_cache.set(cache_key, remembered)
+            return remembered, None
         
         # Si no hay coincidencia, intentar con Gemini
         try:
@@ -169,7 +1247,7 @@ class DatabaseAgent:
             
             INSTRUCCIONES:
             1. Genera una consulta SQL válida para responder la pregunta
-            2. Usa JOINS cuando sea necesario para obtener información completa
+            2. Usa JOIN ... ON explícitos cuando sea necesario (nunca tablas separadas por comas en el FROM)
             3. Incluye nombres de categorías y proveedores en lugar de solo IDs
             4. Limita resultados a 50 filas máximo usando LIMIT
             5. Usa ORDER BY para organizar resultados de manera lógica
@@ -178,199 +1256,338 @@ class DatabaseAgent:
             """
             
             response = self.model.generate_content(prompt)
-            sql_query = response.text.strip()
+            sql_query = self._guard_generated_sql(response.text.strip())
             
-            # Limpiar la respuesta para obtener solo el SQL
-            sql_query = re.sub(r'```sql|```', '', sql_query).strip()
-            
-            return sql_query
+            self.sql_cache.set(cache_key, sql_query)
+            return sql_query, None
             
+        except UnsafeQueryError as e:
+            print(f"Warning: SQL generado rechazado, usando consulta predefinida: {e}")
+            return build_query("stock")
         except Exception as e:
             # Fallback a consulta general de productos
             print(f"Warning: Error con Gemini API, usando consulta predefinida: {e}")
-            return predefined_queries["stock"]
+            return build_query("stock")
     
-    def _interpret_results(self, query_results, user_question):
-        """Interpretar resultados usando Gemini o interpretación básica"""
-        # Si no hay resultados, dar una respuesta apropiada
-        if not query_results or len(query_results) == 0:
-            return f"No se encontraron resultados para tu consulta: '{user_question}'. Verifica que los productos existan en la base de datos o intenta reformular tu pregunta."
+    def _llm_interpretation(self, query_results, user_question, sql_query=None, compacted=None):
+        """Interpretar resultados con Gemini; devuelve None si Gemini no responde"""
+        cache_key = (sql_query, hash_results(query_results)) if sql_query else None
+        if cache_key:
+            cached = self.interpretation_cache.get(cache_key)
+            if cached is not None:
+                return cached
         
-        # Intentar con Gemini primero
         try:
-            prompt = f"""
-            Eres un asistente especializado en inventario de alimentos que interpreta resultados de base de datos.
-            
-            PREGUNTA ORIGINAL: {user_question}
-            
-            RESULTADOS DE LA BASE DE DATOS:
-            {json.dumps(query_results, indent=2, default=str)}
-            
-            INSTRUCCIONES:
-            1. Proporciona una respuesta natural y útil en español
-            2. Resalta información importante como stock bajo, productos próximos a vencer, etc.
-            3. Si no hay resultados, sugiere alternativas o productos similares
-            4. Incluye recomendaciones cuando sea apropiado
-            5. Usa formato claro con bullet points cuando sea necesario
-            6. Sé específico con números y datos encontrados
-            
-            RESPUESTA:
-            """
+            if compacted is None:
+                compacted = compact_results(query_results, self.prompt_token_budget)
+            prompt = INTERPRETATION_PROMPT.format(question=user_question, **compacted)
             
             response = self.model.generate_content(prompt)
             if response.text:
+                if cache_key:
+                    self.interpretation_cache.set(cache_key, response.text)
                 return response.text
-            else:
-                # Fallback a interpretación básica
-                return self._basic_interpretation(query_results, user_question)
+            return None
                 
         except Exception as e:
-            print(f"Warning: Error con Gemini para interpretación, usando interpretación básica: {e}")
-            # Fallback a interpretación básica
-            return self._basic_interpretation(query_results, user_question)
+            print(f"Warning: Error con Gemini para interpretación: {e}")
+            return None
     
-    def _basic_interpretation(self, query_results, user_question):
+    def _interpret_results(self, query_results, user_question, sql_query=None, intent=None, compacted=None):
+        """Interpretar resultados usando Gemini o interpretación básica"""
+        # Si no hay resultados, dar una respuesta apropiada
+        if not query_results or len(query_results) == 0:
+            return f"No se encontraron resultados para tu consulta: '{user_question}'. Verifica que los productos existan en la base de datos o intenta reformular tu pregunta."
+        
+        # Intentar con Gemini primero
+        interpretation = self._llm_interpretation(query_results, user_question, sql_query, compacted)
+        if interpretation:
+            return interpretation
+        # Fallback a interpretación básica
+        return self._basic_interpretation(query_results, user_question, intent)
+    
+    def _respond(self, query_results, user_question, sql_query, intent, compacted):
+        """
+        Redactar la respuesta según la estrategia de la intención.
+        Devuelve (interpretación, enriquecimiento) donde el enriquecimiento es un
+        Future con el texto de Gemini (o None) cuando la estrategia lo pide.
+        """
+        strategy = self.response_policy.get(intent, self.response_policy[None])
+        if strategy == "llm" or not query_results:
+            return self._interpret_results(query_results, user_question, sql_query, intent, compacted), None
+        
+        interpretation = self._basic_interpretation(query_results, user_question, intent)
+        enrichment = None
+        if strategy == "template+llm":
+            enrichment = self._enrichment_executor.submit(
+                self._llm_interpretation, query_results, user_question, sql_query, compacted
+            )
+        return interpretation, enrichment
+    
+    def _basic_interpretation(self, query_results, user_question, intent=None):
         """Interpretación básica sin IA"""
         count = len(query_results)
-        question_lower = user_question.lower()
+        if intent is None:
+            intent = AGENT_ROUTER.classify(user_question)
         
         # Interpretaciones específicas según el tipo de consulta
-        if any(word in question_lower for word in ["stock bajo", "poco stock", "stock menor"]):
+        if intent == "stock_bajo":
             if count == 0:
                 return "🟢 **¡Buenas noticias!** No hay productos con stock bajo en este momento."
-            else:
-                productos_criticos = [p for p in query_results if p.get('cantidad', 0) <= 20]
-                msg = f"⚠️ **Se encontraron {count} productos con stock bajo:**\n\n"
-                for i, producto in enumerate(query_results[:10], 1):
-                    cantidad = producto.get('cantidad', 0)
-                    emoji = "🔴" if cantidad <= 20 else "🟡"
-                    msg += f"{emoji} **{producto.get('nombre', 'N/A')}**: {cantidad} unidades\n"
-                if len(productos_criticos) > 0:
-                    msg += f"\n💡 **Recomendación**: {len(productos_criticos)} productos necesitan reposición urgente (≤20 unidades)."
-                return msg
+            cantidades = column(query_results, 'cantidad', 0, numeric=True)
+            criticos = count_at_most(cantidades, 20)
+            lines = [
+                LOW_STOCK_LINE("🔴" if cantidad <= 20 else "🟡", nombre, cantidad)
+                for nombre, cantidad in zip(column(query_results[:10], 'nombre', 'N/A'), cantidades)
+            ]
+            recomendacion = (
+                f"\n💡 **Recomendación**: {criticos} productos necesitan reposición urgente (≤20 unidades)."
+                if criticos else ""
+            )
+            return f"⚠️ **Se encontraron {count} productos con stock bajo:**\n\n" + block(lines) + recomendacion
                 
-        elif any(word in question_lower for word in ["vencen", "caducan", "expiran"]):
+        elif intent == "vencimiento":
             if count == 0:
                 return "🟢 **¡Perfecto!** No hay productos próximos a vencer en los próximos 30 días."
-            else:
-                msg = f"⚠️ **Se encontraron {count} productos que vencen pronto:**\n\n"
-                for i, producto in enumerate(query_results[:10], 1):
-                    fecha = producto.get('fecha_caducidad', 'N/A')
-                    dias = producto.get('dias_para_vencer', 'N/A')
-                    emoji = "🔴" if isinstance(dias, int) and dias <= 7 else "🟡"
-                    msg += f"{emoji} **{producto.get('nombre', 'N/A')}**: Vence {fecha}\n"
-                return msg
+            lines = [
+                EXPIRY_LINE("🔴" if isinstance(dias, int) and dias <= 7 else "🟡", nombre, fecha)
+                for nombre, fecha, dias in project(
+                    query_results[:10], ('nombre', 'fecha_caducidad', 'dias_para_vencer'),
+                    {'nombre': 'N/A', 'fecha_caducidad': 'N/A', 'dias_para_vencer': 'N/A'},
+                )
+            ]
+            return f"⚠️ **Se encontraron {count} productos que vencen pronto:**\n\n" + block(lines)
                 
-        elif any(word in question_lower for word in ["proveedor", "proveedores"]):
-            msg = f"📊 **Distribución por proveedores ({count} proveedores):**\n\n"
-            for i, proveedor in enumerate(query_results[:10], 1):
-                nombre = proveedor.get('proveedor', 'N/A')
-                productos = proveedor.get('total_productos', 0)
-                unidades = proveedor.get('total_unidades', 0)
-                msg += f"🏦 **{nombre}**: {productos} productos, {unidades} unidades totales\n"
-            return msg
+        elif intent == "proveedores":
+            rows = project(query_results[:10], ('proveedor', 'total_productos', 'total_unidades'),
+                           {'proveedor': 'N/A', 'total_productos': 0, 'total_unidades': 0})
+            return f"📊 **Distribución por proveedores ({count} proveedores):**\n\n" + render(PROVIDER_LINE, rows)
             
-        elif any(word in question_lower for word in ["categoria", "categorías"]):
-            msg = f"📦 **Distribución por categorías ({count} categorías):**\n\n"
-            for i, categoria in enumerate(query_results[:10], 1):
-                nombre = categoria.get('categoria', 'N/A')
-                productos = categoria.get('total_productos', 0)
-                unidades = categoria.get('total_unidades', 0)
-                msg += f"🏷️ **{nombre}**: {productos} productos, {unidades} unidades totales\n"
-            return msg
+        elif intent == "categorias":
+            rows = project(query_results[:10], ('categoria', 'total_productos', 'total_unidades'),
+                           {'categoria': 'N/A', 'total_productos': 0, 'total_unidades': 0})
+            return f"📦 **Distribución por categorías ({count} categorías):**\n\n" + render(CATEGORY_LINE, rows)
             
-        elif any(word in question_lower for word in ["caros", "caro", "precio alto"]):
-            msg = f"💰 **Los {count} productos más caros del inventario:**\n\n"
-            for i, producto in enumerate(query_results[:10], 1):
-                nombre = producto.get('nombre', 'N/A')
-                precio = producto.get('precio_venta', 0)
-                cantidad = producto.get('cantidad', 0)
-                categoria = producto.get('categoria', 'N/A')
-                msg += f"{i}. **{nombre}**: ${precio} ({cantidad} unidades) - {categoria}\n"
-            return msg
+        elif intent == "mas_caros":
+            rows = project(query_results[:10], ('nombre', 'precio_venta', 'cantidad', 'categoria'),
+                           {'nombre': 'N/A', 'precio_venta': 0, 'cantidad': 0, 'categoria': 'N/A'})
+            lines = [PRICEY_LINE(i, *row) for i, row in enumerate(rows, 1)]
+            return f"💰 **Los {count} productos más caros del inventario:**\n\n" + block(lines)
             
         else:
-            # Interpretación general para productos en stock
-            msg = f"📦 **Se encontraron {count} productos en tu inventario:**\n\n"
-            
-            # Estadísticas básicas
-            total_unidades = sum(p.get('cantidad', 0) for p in query_results)
-            valor_total = sum(float(p.get('precio_venta', 0)) * p.get('cantidad', 0) for p in query_results)
-            
-            msg += f"📊 **Resumen:**\n"
-            msg += f"• Total productos: {count}\n"
-            msg += f"• Total unidades: {total_unidades:,}\n"
-            msg += f"• Valor estimado inventario: ${valor_total:,.2f}\n\n"
+            # Interpretación general para productos en stock: estadísticas por columnas
+            stats = stock_stats(column(query_results, 'cantidad', 0, numeric=True),
+                                column(query_results, 'precio_venta', 0, numeric=True))
+            parts = [
+                f"📦 **Se encontraron {count} productos en tu inventario:**\n\n",
+                "📊 **Resumen:**\n",
+                f"• Total productos: {count}\n",
+                f"• Total unidades: {stats['total_unidades']:,}\n",
+                f"• Valor estimado inventario: ${stats['valor_total']:,.2f}\n\n",
+            ]
             
             # Productos con menos stock (para alertas)
-            productos_bajo_stock = [p for p in query_results if p.get('cantidad', 0) <= 50]
-            if productos_bajo_stock:
-                msg += f"⚠️ **Alerta**: {len(productos_bajo_stock)} productos con stock ≤ 50 unidades\n\n"
+            if stats['bajo_stock']:
+                parts.append(f"⚠️ **Alerta**: {stats['bajo_stock']} productos con stock ≤ 50 unidades\n\n")
             
             # Mostrar algunos productos de ejemplo
-            msg += "📋 **Algunos productos destacados:**\n"
-            for i, producto in enumerate(query_results[:5], 1):
-                nombre = producto.get('nombre', 'N/A')
-                cantidad = producto.get('cantidad', 0)
-                precio = producto.get('precio_venta', 0)
-                categoria = producto.get('categoria', 'N/A')
-                msg += f"• **{nombre}**: {cantidad} unidades (${precio}) - {categoria}\n"
-                
+            rows = project(query_results[:5], ('nombre', 'cantidad', 'precio_venta', 'categoria'),
+                           {'nombre': 'N/A', 'cantidad': 0, 'precio_venta': 0, 'categoria': 'N/A'})
+            parts.append("📋 **Algunos productos destacados:**\n")
+            parts.append(render(FEATURED_LINE, rows))
             if count > 5:
-                msg += f"\n... y {count - 5} productos más."
+                parts.append(f"\n... y {count - 5} productos más.")
             
-            return msg
+            return "".join(parts)
+    
+    def _generate_and_execute(self, question, intent):
+        """Generar el SQL y ejecutarlo; devuelve (sql, params, resultados)"""
+        sql_query, params = self._generate_sql_query(question, intent)
+        results = self._execute_plan(sql_query, params)
+        self._remember_sql(question, sql_query, results)
+        return sql_query, params, results
+    
+    def _execute_plan(self, sql_query, params):
+        """Ejecutar el SQL generado (o devolver tal cual el mensaje de error)"""
+        if sql_query.startswith("Error"):
+            return sql_query
+        return self._execute_cached_query(sql_query, params)
+    
+    def _remember_sql(self, question, sql_query, results):
+        """SQL de Gemini que se ejecutó bien: queda disponible para preguntas parecidas"""
+        if isinstance(results, str) or sql_query in PREPARED_SQL:
+            return
+        try:
+            self.query_memory.remember(question, sql_query)
+        except Exception as e:
+            print(f"Warning: No se pudo guardar la consulta en memoria: {e}")
+    
+    def _speculation_guess(self, question):
+        """
+        Intención con la que especular para una pregunta sin palabras clave, o
+        None para ir directo a Gemini. El listado general ("stock") no cuenta:
+        "producto" basta para acercarse a él y no dice nada de la pregunta.
+        """
+        guess = AGENT_ROUTER.guess(question)
+        return None if guess in (None, "stock") else guess
+    
+    def _speculative_generate_and_execute(self, question, guess):
+        """
+        Para preguntas sin intención clara, ejecutar en paralelo la generación de SQL
+        con Gemini y la consulta predefinida `guess`, y quedarse con el primer
+        resultado válido. Devuelve (sql, params, resultados, intención usada).
+        """
+        spec_sql, spec_params = build_query(guess)
+        generated = self._speculation_executor.submit(self._generate_and_execute, question, None)
+        speculative = self._speculation_executor.submit(self._execute_cached_query, spec_sql, spec_params)
+        
+        try:
+            sql_query, params, results = generated.result(timeout=self.speculation_deadline)
+            if not isinstance(results, str):
+                speculative.cancel()
+                return sql_query, params, results, None
+        except FutureTimeoutError:
+            # Gemini sigue trabajando: su SQL quedará en caché para la próxima vez
+            sql_query, params, results = None, None, None
+        
+        spec_results = speculative.result()
+        if not isinstance(spec_results, str):
+            return spec_sql, spec_params, spec_results, guess
+        
+        # La especulación también falló: esperar a Gemini
+        if sql_query is None:
+            sql_query, params, results = generated.result()
+        return sql_query, params, results, None
     
     def ask(self, question):
         """Función principal para hacer preguntas al agente"""
         try:
-            # Paso 1: Generar consulta SQL
-            sql_query = self._generate_sql_query(question)
-            
-            if sql_query.startswith("Error"):
-                return {"error": sql_query, "sql": None, "results": None, "interpretation": None}
-            
-            # Paso 2: Ejecutar consulta
-            results = self._execute_query(sql_query)
-            
-            if isinstance(results, str):  # Error en la consulta
-                return {"error": results, "sql": sql_query, "results": None, "interpretation": None}
+            # Clasificar la pregunta una sola vez para SQL e interpretación
+            intent = AGENT_ROUTER.classify(question)
             
-            # Paso 3: Interpretar resultados
-            interpretation = self._interpret_results(results, question)
+            # Pasos 1 y 2: Generar consulta SQL y ejecutarla
+            guess = None
+            if (intent is None
+                    and self.speculation_deadline > 0
+                    and self.sql_cache.get(normalize_question(question)) is None):
+                guess = self._speculation_guess(question)
+            speculative = guess is not None
+            if speculative:
+                sql_query, params, results, intent = self._speculative_generate_and_execute(question, guess)
+            else:
+                sql_query, params, results = self._generate_and_execute(question, intent)
             
-            return {
-                "sql": sql_query,
-                "results": results,
-                "interpretation": interpretation,
-                "count": len(results) if results else 0
-            }
+            response = self._build_response(question, intent, sql_query, params, results)
+            response["speculative"] = speculative and intent is not None
+            return response
             
         except Exception as e:
             return {"error": f"Error general: {e}", "sql": None, "results": None, "interpretation": None}
     
+    def _build_response(self, question, intent, sql_query, params, results):
+        """Paso 3: interpretar los resultados y armar la respuesta de ask()"""
+        if sql_query.startswith("Error"):
+            return {"error": sql_query, "sql": None, "results": None, "interpretation": None}
+        
+        if isinstance(results, str):  # Error en la consulta
+            return {"error": results, "sql": sql_query, "results": None, "interpretation": None}
+        
+        # Interpretar resultados; solo se compactan si la estrategia arma un prompt para Gemini
+        strategy = self.response_policy.get(intent, self.response_policy[None])
+        compacted = None
+        if results and strategy != "template":
+            compacted = compact_results(results, self.prompt_token_budget)
+        interpretation, enrichment = self._respond(results, question, sql_query, intent, compacted)
+        
+        return {
+            "sql": sql_query,
+            "params": params,
+            "results": results,
+            "interpretation": interpretation,
+            "enrichment": enrichment,
+            "strategy": strategy,
+            "speculative": False,
+            "count": len(results) if results else 0,
+            "truncated": getattr(results, "truncated", False),
+            "prompt_tokens": compacted["estimated_tokens"] if compacted else 0,
+        }
+    
+    def ask_many(self, questions, max_concurrency=None):
+        """
+        Responder un lote de preguntas, devolviendo las respuestas en el mismo orden.
+        
+        Las preguntas idénticas (una vez normalizadas) se responden una sola vez,
+        las que terminan en el mismo SQL comparten una única ejecución, y las
+        llamadas a Gemini corren con concurrencia acotada.
+        """
+        max_concurrency = max_concurrency or int(os.getenv('BATCH_CONCURRENCY', 4))
+        
+        # Deduplicar preguntas normalizadas (se conserva la primera redacción)
+        unique = {}
+        for question in questions:
+            unique.setdefault(normalize_question(question), question)
+        keys = list(unique)
+        intents = {key: AGENT_ROUTER.classify(unique[key]) for key in keys}
+        
+        def generate(key):
+            try:
+                return self._generate_sql_query(unique[key], intents[key])
+            except Exception as e:
+                return f"Error general: {e}", None
+        
+        def execute(plan):
+            return self._execute_plan(*plan)
+        
+        def answer(key):
+            sql_query, params = plans[key]
+            self._remember_sql(unique[key], sql_query, executed[plans[key]])
+            try:
+                return self._build_response(unique[key], intents[key], sql_query, params, executed[plans[key]])
+            except Exception as e:
+                return {"error": f"Error general: {e}", "sql": None, "results": None, "interpretation": None}
+        
+        with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='batch') as executor:
+            # Paso 1: SQL por pregunta única (Gemini solo para las que no están en catálogo ni caché)
+            plans = dict(zip(keys, executor.map(generate, keys)))
+            # Paso 2: una sola ejecución por cada (SQL, parámetros) distinto
+            distinct = list(dict.fromkeys(plans.values()))
+            executed = dict(zip(distinct, executor.map(execute, distinct)))
+            # Paso 3: interpretaciones (y memoria de las preguntas resueltas por Gemini)
+            answers = dict(zip(keys, executor.map(answer, keys)))
+        
+        return [answers[normalize_question(question)] for question in questions]
+    
     def get_product_suggestions(self):
         """Obtener sugerencias de productos disponibles"""
-        query = """
-        SELECT DISTINCT nombre 
-        FROM productos 
-        WHERE cantidad > 0 
-        ORDER BY nombre 
-        LIMIT 20
-        """
-        results = self._execute_query(query)
+        results = self._execute_cached_query(*build_query("sugerencias"))
         return [item['nombre'] for item in results] if results else []
     
-    def get_low_stock_alert(self, threshold=50):
-        """Obtener alerta de stock bajo"""
-        query = f"""
-        SELECT p.nombre, p.cantidad, c.nombre as categoria 
-        FROM productos p 
-        LEFT JOIN categorias c ON p.id_categoria = c.id 
-        WHERE p.cantidad <= %s 
-        ORDER BY p.cantidad ASC
-        """
-        return self._execute_query(query, (threshold,))
+    def get_movements_page(self, after=None, limit=200):
+        """Página del historial de movimientos; `after` es (fecha, id) de la última fila vista"""
+        if after is None:
+            return self._execute_cached_query(*build_query("movimientos", limite=limit))
+        fecha, last_id = after
+        return self._execute_cached_query(*build_query(
+            "movimientos_siguientes", fecha=fecha, fecha_igual=fecha, id=last_id, limite=limit
+        ))
+    
+    def get_low_stock_alert(self, threshold=50, limit=None):
+        """Obtener alerta de stock bajo (desde el índice en memoria)"""
+        try:
+            products = self.stock_index.below(threshold, limit)
+        except Exception as e:
+            print(f"Warning: Índice de stock no disponible, consultando MySQL: {e}")
+            results = self._execute_cached_query(*build_query("alerta_stock_bajo", umbral=threshold))
+            return results[:limit] if limit is not None and not isinstance(results, str) else results
+        return [
+            {"nombre": p["nombre"], "cantidad": p["cantidad"], "categoria": p["categoria"]}
+            for p in products
+        ]
+
+    def get_expiring_products(self, days=7, limit=None):
+        """Productos que vencen en los próximos `days` días (desde el índice en memoria)"""
+        until = date.today() + timedelta(days=days)
+        return self.stock_index.expiring_before(until, limit)
 
 # Función para testing
 if __name__ == "__main__":
@@ -397,8 +1614,8 @@ if __name__ == "__main__":
     # Test generación de SQL
     print("\n=== TEST GENERACIÓN SQL ===")
     question = "¿Qué productos tengo en stock?"
-    sql = agent._generate_sql_query(question)
-    print(f"SQL Generado: {sql}")
+    sql, params = agent._generate_sql_query(question)
+    print(f"SQL Generado: {sql} {params or ''}")
     
     # Test consulta completa
     print("\n=== TEST CONSULTA COMPLETA ===")
@@ -412,10 +1629,17 @@ if __name__ == "__main__":
         "¿Cuáles son los productos con stock bajo?",
     ]
     
-    for question in test_questions:
+    for question, response in zip(test_questions, agent.ask_many(test_questions)):
         print(f"\nPREGUNTA: {question}")
-        response = agent.ask(question)
         print(f"SQL: {response.get('sql', 'N/A')}")
         print(f"Resultados: {len(response.get('results', []))} registros")
         print(f"RESPUESTA: {response.get('interpretation', 'N/A')}")
-        print("-" * 50)
\ No newline at end of file
+        print("-" * 50)
+
+    print("\n=== TEST RESÚMENES DE INVENTARIO ===")
+    differences = agent.inventory_summary.check_consistency()
+    print("✅ Resúmenes consistentes" if not differences else f"❌ Diferencias: {differences}")
+
+    print(f"\nEstadísticas del pool: {agent.get_pool_stats()}")
+    print(f"Estadísticas de caché: {agent.get_cache_stats()}")
+    print(f"Estadísticas de Gemini: {agent.get_llm_stats()}")
\ No newline at end of file
@@ -0,0 +1,34 @@
+import sqlite3
+
+import registry
+
+# --- CONEXIONES DE LOS SCRIPTS DE MANTENIMIENTO ---
+# migrations.py y movement_ingest.py trabajan contra MySQL o, para pruebas
+# locales, contra un archivo SQLite. Las consultas se escriben con los
+# marcadores de mysql.connector (%s) y se adaptan aquí según el driver.
+
+
+def dialect(conn):
+    """'sqlite' o 'mysql' según el driver de la conexión"""
+    return "sqlite" if isinstance(conn, sqlite3.Connection) else "mysql"
+
+
+def is_sqlite(conn):
+    return dialect(conn) == "sqlite"
+
+
+def placeholder(conn):
+    return "?" if is_sqlite(conn) else "%s"
+
+
+def adapt(conn, sql):
+    """Adaptar los marcadores de parámetros al driver"""
+    return sql.replace("%s", "?") if is_sqlite(conn) else sql
+
+
+def connect(sqlite_path=None):
+    """Conexión a SQLite si se indica un archivo; si no, a MySQL (secrets.toml)"""
+    if sqlite_path:
+        return sqlite3.connect(sqlite_path)
+    import mysql.connector
+    return mysql.connector.connect(**registry.get_db_config())
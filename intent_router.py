@@ -0,0 +1,129 @@
+import unicodedata
+
+
+def fold_accents(text):
+    """Pasar a minúsculas y quitar acentos ("Categorías" -> "categorias")"""
+    return unicodedata.normalize('NFKD', text.lower()).encode('ascii', 'ignore').decode('ascii')
+
+
+class IntentRouter:
+    """
+    Clasificador de intenciones por palabras clave, compilado una sola vez.
+
+    Las intenciones se declaran en orden de prioridad. Al construirlo se
+    normalizan los acentos de todas las palabras clave, se descartan las
+    redundantes (las que contienen otra palabra clave de igual o mayor
+    prioridad, p. ej. "más caros" ya cubierta por "caro") y se aplanan en una
+    tabla ordenada. Clasificar es plegar el texto una vez y recorrer la tabla
+    hasta la primera coincidencia, que es la de mayor prioridad.
+    """
+
+    def __init__(self, intents, stem_length=4):
+        self.intents = [name for name, _ in intents]
+        self.stem_length = stem_length
+        # Raíces de las palabras clave para adivinar la intención de preguntas ambiguas
+        self._stems = {}
+        for index, (_, keywords) in enumerate(intents):
+            for word in {w for keyword in keywords for w in fold_accents(keyword).split()}:
+                if len(word) >= stem_length:
+                    self._stems.setdefault(word[:stem_length], set()).add(index)
+        table = []
+        for index, (_, keywords) in enumerate(intents):
+            for word in sorted({fold_accents(word) for word in keywords}, key=len):
+                if not any(known in word for known, _ in table):
+                    table.append((word, index))
+        self._table = tuple(table)
+
+    def classify(self, text):
+        """Devolver la intención de mayor prioridad presente en el texto (o None)"""
+        folded = fold_accents(text)
+        for word, index in self._table:
+            if word in folded:
+                return self.intents[index]
+        return None
+
+    def guess(self, text):
+        """
+        Intención más probable para un texto sin palabras clave exactas,
+        comparando raíces ("caducidad" ~ "caducan"). Empata por prioridad.
+        """
+        scores = {}
+        for word in fold_accents(text).split():
+            for index in self._stems.get(word[:self.stem_length], ()):
+                scores[index] = scores.get(index, 0) + 1
+        if not scores:
+            return None
+        best = min(scores, key=lambda index: (-scores[index], index))
+        return self.intents[best]
+
+
+# Intenciones del agente de inventario (DatabaseAgent), por prioridad
+AGENT_ROUTER = IntentRouter([
+    ("stock_bajo", ["stock bajo", "poco stock", "stock menor", "bajo stock"]),
+    ("vencimiento", ["vencen", "caducan", "expiran", "vencimiento"]),
+    ("proveedores", ["proveedor", "proveedores"]),
+    ("categorias", ["categoria", "categorías", "categorias"]),
+    ("mas_caros", ["caros", "caro", "precio alto", "más caros"]),
+    ("stock", ["stock", "productos", "inventario", "tengo"]),
+])
+
+# Intenciones del chat de ventas (services.py), por prioridad
+CHAT_ROUTER = IntentRouter([
+    ("stock", ['stock', 'inventario', 'cantidad', 'cuántos', 'cuantos']),
+    ("price", ['precio', 'costo', 'vale', 'cuesta']),
+    ("product", ['producto', 'artículo', 'item']),
+])
+
+
+# Micro-benchmark contra las cadenas de `any(word in texto ...)` anteriores
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    def legacy_classify(question):
+        question_lower = question.lower()
+        if any(word in question_lower for word in ["stock bajo", "poco stock", "stock menor", "bajo stock"]):
+            return "stock_bajo"
+        elif any(word in question_lower for word in ["vencen", "caducan", "expiran", "vencimiento"]):
+            return "vencimiento"
+        elif any(word in question_lower for word in ["proveedor", "proveedores"]):
+            return "proveedores"
+        elif any(word in question_lower for word in ["categoria", "categorías", "categorias"]):
+            return "categorias"
+        elif any(word in question_lower for word in ["caros", "caro", "precio alto", "más caros"]):
+            return "mas_caros"
+        elif any(word in question_lower for word in ["stock", "productos", "inventario", "tengo"]):
+            return "stock"
+        return None
+
+    random.seed(42)
+    templates = [
+        "¿Qué productos tengo en stock?",
+        "¿Cuáles son los productos con stock bajo?",
+        "¿Qué productos vencen en los próximos 30 días?",
+        "¿Cuántos productos tengo de cada proveedor?",
+        "¿Cómo se distribuyen mis productos por categorías?",
+        "¿Cuáles son los 10 productos más caros?",
+        "¿Cuál es el producto más vendido este mes?",
+        "Muéstrame el historial de movimientos de la bodega",
+    ]
+    fillers = ["por favor", "hoy", "en la sucursal centro", "de lácteos", "urgente", ""]
+    corpus = [f"{random.choice(templates)} {random.choice(fillers)}" for _ in range(5000)]
+
+    mismatches = [q for q in corpus if legacy_classify(q) != AGENT_ROUTER.classify(q)]
+    print(f"Corpus: {len(corpus)} preguntas, diferencias con la cadena anterior: {len(mismatches)}")
+    for q in sorted(set(mismatches))[:5]:
+        print(f"  {q!r}: {legacy_classify(q)} -> {AGENT_ROUTER.classify(q)}")
+
+    # Clasificación contra clasificación: una pasada de la cadena frente al router
+    timings = {}
+    for name, func in [("cadena any()", legacy_classify), ("router compilado", AGENT_ROUTER.classify)]:
+        seconds = min(timeit.repeat(lambda: [func(q) for q in corpus], number=1, repeat=5))
+        timings[name] = seconds
+        print(f"{name:>18}: {seconds * 1000:.1f} ms ({seconds / len(corpus) * 1e6:.2f} µs/pregunta)")
+    print(f"{'aceleración':>18}: {timings['cadena any()'] / timings['router compilado']:.1f}x")
+
+    # Aparte: antes ask() clasificaba dos veces (SQL e interpretación); ahora la
+    # intención se calcula una vez y se reutiliza, lo que ahorra una cadena completa
+    saved = timings['cadena any()'] / len(corpus)
+    print(f"{'2ª clasificación':>18}: {saved * 1e6:.2f} µs/pregunta ahorrados por no repetirla")
@@ -0,0 +1,273 @@
+import os
+import random
+import threading
+import time
+
+_retryable_errors = None
+_service_errors = None
+
+
+def retryable_errors():
+    """Errores de Gemini que vale la pena reintentar (cuota, sobrecarga, timeouts)"""
+    global _retryable_errors
+    if _retryable_errors is None:
+        # Importación diferida: google.api_core solo se carga al llamar a Gemini
+        from google.api_core import exceptions as google_exceptions
+        _retryable_errors = (
+            google_exceptions.ResourceExhausted,
+            google_exceptions.TooManyRequests,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.InternalServerError,
+            google_exceptions.DeadlineExceeded,
+            TimeoutError,
+            ConnectionError,
+        )
+    return _retryable_errors
+
+
+def service_errors():
+    """
+    Errores no recuperables que indican un problema del servicio o de la
+    configuración (API key inválida, sin permisos, modelo inexistente) y no
+    de la solicitud: se repiten en cada llamada, así que abren el circuito.
+    """
+    global _service_errors
+    if _service_errors is None:
+        from google.api_core import exceptions as google_exceptions
+        _service_errors = (
+            google_exceptions.Unauthenticated,
+            google_exceptions.PermissionDenied,
+            google_exceptions.NotFound,
+        )
+    return _service_errors
+
+
+def _is_service_error(error):
+    # Gemini responde INVALID_ARGUMENT ("API key not valid") ante una API key mal escrita
+    return isinstance(error, service_errors()) or "api key" in str(error).lower()
+
+
+def estimate_tokens(text):
+    """Estimación rápida de tokens (~4 caracteres por token)"""
+    return (len(text) + 3) // 4
+
+
+class LLMUnavailableError(Exception):
+    """Gemini no está disponible (circuito abierto, sin cupo o plazo agotado)"""
+
+
+class TokenBucket:
+    """Limitador de tasa: `rate` solicitudes por segundo con ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, timeout):
+        """Tomar un token esperando como mucho `timeout` segundos; devuelve si se obtuvo"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Cortacircuitos: tras `failure_threshold` fallos seguidos se abre y rechaza
+    las llamadas durante `reset_timeout` segundos; luego deja pasar una de
+    prueba (semiabierto) y se cierra si tiene éxito.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+        self.transitions = {self.OPEN: 0, self.HALF_OPEN: 0, self.CLOSED: 0}
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.transitions[state] += 1
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def record_neutral(self):
+        """
+        La llamada no dice nada de la salud del servicio (no llegó a hacerse o
+        falló por la propia solicitud): libera la prueba del estado semiabierto
+        sin cerrar el circuito ni tocar el conteo de fallos.
+        """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+
+class ResilientModel:
+    """
+    Envoltorio de un modelo de Gemini con limitación de tasa, reintentos con
+    backoff exponencial y jitter, plazo máximo por solicitud y cortacircuitos.
+
+    Cuando el circuito está abierto las llamadas fallan al instante con
+    LLMUnavailableError, de modo que los llamadores pasan directo a sus
+    respuestas de respaldo en lugar de esperar un error lento.
+    """
+
+    def __init__(self, model, limiter=None, breaker=None, max_retries=None,
+                 deadline=None, base_delay=0.5, max_delay=8.0):
+        self.model = model
+        self.limiter = limiter or shared_rate_limiter()
+        self.breaker = breaker or shared_circuit_breaker()
+        self.max_retries = int(os.getenv('GEMINI_MAX_RETRIES', 3)) if max_retries is None else max_retries
+        self.deadline = float(os.getenv('GEMINI_DEADLINE', 30)) if deadline is None else deadline
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+        self._stats = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "rejected_open": 0,
+            "deadline_exceeded": 0,
+        }
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def call(self, fn, *args, **kwargs):
+        """Ejecutar `fn(*args, **kwargs)` (una llamada a Gemini) con todas las protecciones"""
+        self._count("calls")
+        if not self.breaker.allow():
+            self._count("rejected_open")
+            raise LLMUnavailableError("Circuito abierto: Gemini no está respondiendo")
+
+        deadline = time.monotonic() + self.deadline
+        retryable = retryable_errors()
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if not self.limiter.acquire(timeout=max(0.0, remaining)):
+                self._count("rate_limited")
+                self.breaker.record_neutral()
+                raise LLMUnavailableError("Límite de solicitudes a Gemini alcanzado")
+
+            remaining = deadline - time.monotonic()
+            try:
+                result = fn(*args, request_options={"timeout": max(1.0, remaining)}, **kwargs)
+            except retryable as e:
+                attempt += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                delay = random.uniform(0, delay)  # Jitter completo
+                if attempt > self.max_retries or time.monotonic() + delay >= deadline:
+                    if time.monotonic() + delay >= deadline:
+                        self._count("deadline_exceeded")
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise
+                self._count("retries")
+                print(f"Warning: Error temporal con Gemini, reintentando en {delay:.1f}s: {e}")
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                self._count("failures")
+                if _is_service_error(e):
+                    # Credenciales o permisos: todas las llamadas fallarán igual
+                    self.breaker.record_failure()
+                else:
+                    # Error propio de la solicitud (prompt inválido, etc.): no abre el
+                    # circuito, pero tampoco lo cierra ni borra los fallos anteriores
+                    self.breaker.record_neutral()
+                raise
+
+            self._count("successes")
+            self.breaker.record_success()
+            return result
+
+    def generate_content(self, *args, **kwargs):
+        return self.call(self.model.generate_content, *args, **kwargs)
+
+    def __getattr__(self, name):
+        # start_chat y demás atributos del modelo original
+        return getattr(self.model, name)
+
+    def stats(self):
+        """Métricas de llamadas, reintentos y estado del cortacircuitos"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            "circuit_state": self.breaker.state,
+            "circuit_transitions": dict(self.breaker.transitions),
+        })
+        return stats
+
+
+# Limitador y cortacircuitos compartidos por todo el proceso (la cuota es por API key).
+# Se crean en el primer uso para respetar las variables cargadas desde .env.
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_rate_limiter():
+    with _shared_lock:
+        if "limiter" not in _shared:
+            _shared["limiter"] = TokenBucket(
+                rate=float(os.getenv('GEMINI_RATE_LIMIT', 2)),
+                capacity=int(os.getenv('GEMINI_BURST', 5)),
+            )
+        return _shared["limiter"]
+
+
+def shared_circuit_breaker():
+    with _shared_lock:
+        if "breaker" not in _shared:
+            _shared["breaker"] = CircuitBreaker(
+                failure_threshold=int(os.getenv('GEMINI_BREAKER_FAILURES', 5)),
+                reset_timeout=float(os.getenv('GEMINI_BREAKER_RESET', 30)),
+            )
+        return _shared["breaker"]
@@ -0,0 +1,83 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from result_stream import ResultSet
+
+# --- CACHÉ LRU ---
+# Usada por el agente (SQL, resultados y respuestas) y por las métricas del
+# dashboard de Flask; no depende de MySQL ni de Gemini.
+
+
+class LRUCache:
+    """Caché LRU thread-safe con TTL opcional y límite de tamaño en bytes"""
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, str):
+            return len(value.encode('utf-8'))
+        if isinstance(value, ResultSet):
+            return value.nbytes
+        return len(json.dumps(value, default=str))
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            value, _, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return  # No cabe ni solo: no se cachea
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def values(self):
+        """Copia de los valores vigentes (del más antiguo al más reciente)"""
+        with self._lock:
+            return [value for value, _, _ in self._data.values()]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._data), "bytes": self._bytes})
+        return stats
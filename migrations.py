@@ -0,0 +1,143 @@
+import argparse
+
+from db_util import adapt, connect, is_sqlite, placeholder
+from database_agent import QUERY_CATALOG, build_query
+
+# --- MIGRACIONES DE ESQUEMA ---
+# Índices para los predicados y ordenamientos de las consultas más frecuentes.
+# Cada migración se aplica una sola vez y queda registrada en schema_migrations.
+MIGRATIONS = [
+    ("001_idx_productos_cantidad", [
+        # stock_bajo / alerta_stock_bajo: WHERE cantidad <= ? ORDER BY cantidad
+        "CREATE INDEX idx_productos_cantidad ON productos (cantidad, nombre, id_categoria)",
+    ]),
+    ("002_idx_productos_caducidad", [
+        # vencimiento: WHERE fecha_caducidad <= ? ORDER BY fecha_caducidad
+        "CREATE INDEX idx_productos_caducidad ON productos (fecha_caducidad)",
+    ]),
+    ("003_idx_productos_nombre", [
+        # stock / sugerencias: WHERE cantidad > 0 ORDER BY nombre (índice cubriente)
+        "CREATE INDEX idx_productos_nombre ON productos (nombre, cantidad)",
+    ]),
+    ("004_idx_productos_precio", [
+        # mas_caros: ORDER BY precio_venta DESC LIMIT n
+        "CREATE INDEX idx_productos_precio ON productos (precio_venta)",
+    ]),
+    ("005_idx_productos_fk", [
+        # JOIN/GROUP BY por categoría y proveedor sumando cantidad (cubrientes)
+        "CREATE INDEX idx_productos_categoria ON productos (id_categoria, cantidad)",
+        "CREATE INDEX idx_productos_proveedor ON productos (id_proveedor, cantidad)",
+    ]),
+    ("006_idx_movimientos", [
+        # Historial ordenado por fecha y movimientos por producto
+        "CREATE INDEX idx_movimientos_fecha ON movimientos_inventario (fecha, id)",
+        "CREATE INDEX idx_movimientos_producto ON movimientos_inventario (id_producto, fecha)",
+    ]),
+]
+
+
+def _rows_as_dicts(cursor):
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def applied_migrations(conn):
+    """Nombres de las migraciones ya aplicadas"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name VARCHAR(255) PRIMARY KEY,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT name FROM schema_migrations")
+    applied = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return applied
+
+
+def apply_migrations(conn):
+    """Aplicar las migraciones pendientes y devolver sus nombres"""
+    applied = applied_migrations(conn)
+    pending = [(name, statements) for name, statements in MIGRATIONS if name not in applied]
+    cursor = conn.cursor()
+    for name, statements in pending:
+        for statement in statements:
+            try:
+                cursor.execute(statement)
+            except Exception as e:
+                # El índice pudo crearse a mano antes de existir esta migración
+                if "Duplicate key name" not in str(e) and "already exists" not in str(e):
+                    raise Exception(f"Error aplicando migración {name}: {e}")
+        cursor.execute(
+            f"INSERT INTO schema_migrations (name) VALUES ({placeholder(conn)})", (name,)
+        )
+        conn.commit()
+        print(f"✅ Migración aplicada: {name}")
+    cursor.close()
+    return [name for name, _ in pending]
+
+
+# --- ANALIZADOR DE PLANES (EXPLAIN) ---
+def explain_query(conn, sql, params=None):
+    """
+    Ejecutar EXPLAIN sobre una consulta y señalar los recorridos completos de tabla.
+    Devuelve un dict con el plan y la lista de tablas recorridas por completo.
+    """
+    cursor = conn.cursor()
+    try:
+        if is_sqlite(conn):
+            cursor.execute(f"EXPLAIN QUERY PLAN {adapt(conn, sql)}", params or ())
+            plan = _rows_as_dicts(cursor)
+            # "SCAN t" es un recorrido completo; "SCAN t USING [COVERING] INDEX" no
+            full_scans = [
+                row["detail"].split()[1] for row in plan
+                if row["detail"].startswith("SCAN ") and "INDEX" not in row["detail"]
+            ]
+        else:
+            cursor.execute(f"EXPLAIN {sql}", params or ())
+            plan = _rows_as_dicts(cursor)
+            full_scans = [row["table"] for row in plan if row.get("type") == "ALL"]
+        return {"plan": plan, "full_scans": full_scans, "error": None}
+    except Exception as e:
+        return {"plan": [], "full_scans": [], "error": str(e)}
+    finally:
+        cursor.close()
+
+
+def explain_queries(conn, queries):
+    """Analizar un dict {nombre: (sql, params)} e imprimir un resumen"""
+    report = {}
+    for name, (sql, params) in queries.items():
+        result = explain_query(conn, sql, params)
+        report[name] = result
+        if result["error"]:
+            print(f"❔ {name}: no se pudo analizar ({result['error']})")
+        elif result["full_scans"]:
+            print(f"⚠️ {name}: recorrido completo de {', '.join(result['full_scans'])}")
+        else:
+            print(f"✅ {name}: usa índices")
+    return report
+
+
+def catalog_queries():
+    """Consultas del catálogo con sus parámetros por defecto"""
+    return {name: build_query(name) for name in QUERY_CATALOG}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migraciones de índices y análisis de consultas")
+    parser.add_argument("command", choices=["migrate", "explain"])
+    parser.add_argument("--sqlite", help="Usar una base SQLite local en lugar de MySQL")
+    args = parser.parse_args()
+
+    conn = connect(args.sqlite)
+    try:
+        if args.command == "migrate":
+            applied = apply_migrations(conn)
+            if not applied:
+                print("No hay migraciones pendientes.")
+        else:
+            explain_queries(conn, catalog_queries())
+    finally:
+        conn.close()
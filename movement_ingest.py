@@ -0,0 +1,282 @@
+import argparse
+import codecs
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from db_util import adapt, connect, dialect
+from intent_router import fold_accents
+
+# --- CARGA MASIVA DE MOVIMIENTOS ---
+# Ingesta de entradas/salidas de inventario desde CSV o NDJSON (por ejemplo el
+# volcado diario del punto de venta). Las filas se leen en streaming, se
+# validan (incluido el stock disponible para cada salida) y se aplican por lotes: un INSERT con executemany y un único UPDATE
+# de stock por lote (suma neta por producto), ambos en la misma transacción.
+
+MOVEMENT_TYPES = {"entrada": 1, "salida": -1}
+FORMATS = ("csv", "ndjson")
+DEFAULT_BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+INSERT_SQL = """
+    INSERT INTO movimientos_inventario (id_producto, tipo_movimiento, cantidad, fecha, descripcion)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# Netos por producto del lote en curso: el UPDATE de stock es un join contra
+# esta tabla (un CASE con miles de ramas se evalúa rama a rama en cada fila)
+DELTAS_TABLE_SQL = "CREATE TEMPORARY TABLE IF NOT EXISTS stock_deltas (id_producto INT PRIMARY KEY, delta INT NOT NULL)"
+DELTAS_INSERT_SQL = "INSERT INTO stock_deltas (id_producto, delta) VALUES (%s, %s)"
+STOCK_UPDATE_SQL = {
+    "mysql": """
+        UPDATE productos p JOIN stock_deltas d ON p.id = d.id_producto
+        SET p.cantidad = COALESCE(p.cantidad, 0) + d.delta
+    """,
+    "sqlite": """
+        UPDATE productos SET cantidad = COALESCE(cantidad, 0) + d.delta
+        FROM stock_deltas d WHERE productos.id = d.id_producto
+    """,
+}
+
+
+class InvalidMovement(ValueError):
+    """La fila no es un movimiento válido y se descarta"""
+
+
+class InsufficientStock(InvalidMovement):
+    """La salida dejaría el producto con stock negativo"""
+
+
+def read_csv(stream):
+    """(línea, registro) de un CSV con encabezado"""
+    for line, record in enumerate(csv.DictReader(stream), 2):
+        yield line, record
+
+
+def read_ndjson(stream):
+    """(línea, registro) de un archivo con un objeto JSON por línea"""
+    for line, text in enumerate(stream, 1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            record = json.loads(text)
+        except json.JSONDecodeError as e:
+            record = InvalidMovement(f"JSON no válido: {e.msg}")
+        if not isinstance(record, (dict, InvalidMovement)):
+            record = InvalidMovement("Se esperaba un objeto JSON")
+        yield line, record
+
+
+READERS = {"csv": read_csv, "ndjson": read_ndjson}
+
+
+def _integer(record, field):
+    value = record.get(field)
+    if isinstance(value, bool):
+        raise InvalidMovement(f"{field} no es un entero: {value!r}")
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        raise InvalidMovement(f"{field} no es un entero: {value!r}") from None
+
+
+def parse_movement(record, stock, now=None):
+    """
+    Validar un registro y devolver la tupla para INSERT_SQL. `stock` es el
+    saldo de cada producto hasta la fila anterior (ver load_stock).
+    """
+    if isinstance(record, InvalidMovement):
+        raise record
+
+    product_id = _integer(record, "id_producto")
+    if product_id not in stock:
+        raise InvalidMovement(f"El producto {product_id} no existe")
+
+    kind = fold_accents(str(record.get("tipo_movimiento") or "")).strip()
+    if kind not in MOVEMENT_TYPES:
+        raise InvalidMovement(f"tipo_movimiento debe ser 'entrada' o 'salida': {record.get('tipo_movimiento')!r}")
+
+    quantity = _integer(record, "cantidad")
+    if quantity <= 0:
+        raise InvalidMovement(f"cantidad debe ser mayor que 0: {quantity}")
+
+    if kind == "salida" and quantity > stock[product_id]:
+        raise InsufficientStock(f"salida de {quantity} unidades del producto {product_id} "
+                                f"supera el stock disponible ({stock[product_id]})")
+
+    moved_at = record.get("fecha")
+    if moved_at in (None, ""):
+        moved_at = now or datetime.now()
+    else:
+        try:
+            moved_at = datetime.fromisoformat(str(moved_at).strip())
+        except ValueError:
+            raise InvalidMovement(f"fecha no es ISO 8601: {moved_at!r}") from None
+
+    description = record.get("descripcion")
+    if description is not None:
+        description = str(description).strip() or None
+    return product_id, kind, quantity, moved_at, description
+
+
+def load_stock(conn):
+    """Stock actual de cada producto (NULL cuenta como 0, igual que en el UPDATE)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id, cantidad FROM productos")
+        return {row[0]: row[1] or 0 for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def prepare(conn):
+    """Crear la tabla temporal de netos (propia de la conexión)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(DELTAS_TABLE_SQL)
+    finally:
+        cursor.close()
+
+
+def apply_batch(conn, batch):
+    """
+    Insertar los movimientos del lote y ajustar el stock con un solo UPDATE
+    (la suma neta de cada producto), en una transacción.
+    """
+    deltas = {}
+    for product_id, kind, quantity, _, _ in batch:
+        deltas[product_id] = deltas.get(product_id, 0) + MOVEMENT_TYPES[kind] * quantity
+    changed = [(product_id, delta) for product_id, delta in deltas.items() if delta]
+
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(adapt(conn, INSERT_SQL), batch)
+        if changed:
+            cursor.execute("DELETE FROM stock_deltas")
+            cursor.executemany(adapt(conn, DELTAS_INSERT_SQL), changed)
+            cursor.execute(STOCK_UPDATE_SQL[dialect(conn)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(changed)
+
+
+def ingest(conn, stream, fmt="csv", batch_size=None, on_batch=None):
+    """
+    Cargar los movimientos de `stream` (texto CSV o NDJSON). Las filas no
+    válidas se descartan y se informan, igual que las salidas sin stock
+    suficiente (el saldo se lleva fila a fila, en el orden del archivo); si
+    un lote falla se revierte y la carga se detiene (los lotes anteriores
+    quedan aplicados).
+    Devuelve un reporte con filas leídas, insertadas, rechazadas y filas/segundo.
+    """
+    if fmt not in READERS:
+        raise ValueError(f"Formato desconocido: {fmt} (use {', '.join(FORMATS)})")
+    batch_size = batch_size or int(os.getenv('INGEST_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    stock = load_stock(conn)
+    prepare(conn)
+    now = datetime.now()
+
+    report = {"leidas": 0, "insertadas": 0, "rechazadas": 0, "sin_stock": 0, "productos_actualizados": 0,
+              "lotes": 0, "errores": [], "error": None}
+    start = time.perf_counter()
+
+    def flush(batch, first_line):
+        try:
+            report["productos_actualizados"] += apply_batch(conn, batch)
+        except Exception as e:
+            report["error"] = f"Error aplicando el lote que empieza en la línea {first_line}: {e}"
+            return False
+        report["insertadas"] += len(batch)
+        report["lotes"] += 1
+        if on_batch:
+            on_batch(report, time.perf_counter() - start)
+        return True
+
+    batch = []
+    first_line = None
+    for line, record in READERS[fmt](stream):
+        report["leidas"] += 1
+        try:
+            movement = parse_movement(record, stock, now)
+        except InvalidMovement as e:
+            report["rechazadas"] += 1
+            if isinstance(e, InsufficientStock):
+                report["sin_stock"] += 1
+            if len(report["errores"]) < MAX_REPORTED_ERRORS:
+                report["errores"].append({"linea": line, "error": str(e)})
+            continue
+        product_id, kind, quantity = movement[:3]
+        stock[product_id] += MOVEMENT_TYPES[kind] * quantity
+        if not batch:
+            first_line = line
+        batch.append(movement)
+        if len(batch) >= batch_size:
+            if not flush(batch, first_line):
+                break
+            batch = []
+    else:
+        if batch:
+            flush(batch, first_line)
+
+    report["segundos"] = round(time.perf_counter() - start, 3)
+    report["filas_por_segundo"] = round(report["insertadas"] / report["segundos"]) if report["segundos"] else 0
+    return report
+
+
+def detect_format(name, default="csv"):
+    """Formato según la extensión o el tipo MIME"""
+    name = (name or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "json" in name:
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in name:
+        return "csv"
+    return default
+
+
+def open_text(binary_stream):
+    """Flujo binario (archivo, stdin o cuerpo HTTP) como texto UTF-8, con o sin BOM"""
+    return codecs.getreader("utf-8-sig")(binary_stream)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga masiva de movimientos de inventario")
+    parser.add_argument("file", help="Archivo CSV o NDJSON ('-' para leer de la entrada estándar)")
+    parser.add_argument("--format", choices=FORMATS, help="Formato (por defecto según la extensión)")
+    parser.add_argument("--batch-size", type=int, help=f"Filas por lote (por defecto {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--sqlite", help="Usar una base SQLite local en lugar de MySQL")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+
+    def progress(report, elapsed):
+        print(f"Lote {report['lotes']}: {report['insertadas']:,} filas "
+              f"({report['insertadas'] / elapsed:,.0f} filas/s)")
+
+    conn = connect(args.sqlite)
+    binary = sys.stdin.buffer if args.file == "-" else open(args.file, "rb")
+    try:
+        report = ingest(conn, open_text(binary), fmt, args.batch_size, on_batch=progress)
+    finally:
+        if binary is not sys.stdin.buffer:
+            binary.close()
+        conn.close()
+
+    print(f"✅ {report['insertadas']:,} movimientos insertados en {report['segundos']} s "
+          f"({report['filas_por_segundo']:,} filas/s), {report['productos_actualizados']:,} "
+          f"actualizaciones de stock")
+    if report["rechazadas"]:
+        print(f"⚠️ {report['rechazadas']:,} filas rechazadas "
+              f"({report['sin_stock']:,} salidas sin stock suficiente):")
+        for error in report["errores"]:
+            print(f"  línea {error['linea']}: {error['error']}")
+    if report["error"]:
+        print(f"❌ {report['error']}")
+        sys.exit(1)
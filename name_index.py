@@ -0,0 +1,200 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+
+from intent_router import fold_accents
+
+# --- ÍNDICE DE NOMBRES DE PRODUCTO ---
+# Búsqueda aproximada de productos por nombre sin recorrer la tabla con
+# LIKE '%...%': un índice invertido de trigramas (sin acentos ni mayúsculas)
+# en memoria que devuelve los ids candidatos ordenados por similitud.
+
+
+def _normalize(text):
+    return " ".join(fold_accents(text).split())
+
+
+def trigrams(text):
+    """Trigramas de cada palabra, con bordes marcados ("  ar", " arr", ..., "oz ")"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """Índice invertido trigrama -> ids, con búsqueda por subcadena y por similitud"""
+
+    def __init__(self, max_candidates=1000):
+        self.max_candidates = max_candidates
+        self._names = {}  # id -> nombre normalizado
+        self._grams = {}  # id -> trigramas del nombre
+        self._postings = defaultdict(set)  # trigrama -> ids
+
+    def __len__(self):
+        return len(self._names)
+
+    def add(self, item_id, name):
+        self.remove(item_id)
+        normalized = _normalize(name or "")
+        grams = trigrams(normalized)
+        self._names[item_id] = normalized
+        self._grams[item_id] = grams
+        for gram in grams:
+            self._postings[gram].add(item_id)
+
+    def remove(self, item_id):
+        grams = self._grams.pop(item_id, None)
+        if grams is None:
+            return
+        del self._names[item_id]
+        for gram in grams:
+            ids = self._postings[gram]
+            ids.discard(item_id)
+            if not ids:
+                del self._postings[gram]
+
+    def search(self, text, limit=5, min_score=0.3):
+        """
+        Ids ordenados por relevancia. Si algún nombre contiene el texto (lo que
+        antes encontraba LIKE) se devuelven esos; si no, los más parecidos por
+        coeficiente de Dice sobre trigramas, para tolerar errores de tipeo.
+        """
+        query = _normalize(text)
+        if not query:
+            return []
+        query_grams = trigrams(query)
+
+        # Coincidencias por subcadena: candidatos con todos los trigramas interiores de cada palabra
+        inner = {word[i:i + 3] for word in query.split() for i in range(len(word) - 2)}
+        if inner:
+            postings = [self._postings.get(gram) for gram in inner]
+            if all(postings):
+                postings.sort(key=len)
+                candidates = postings[0].intersection(*postings[1:])
+            else:
+                candidates = ()
+        else:
+            candidates = self._names.keys()  # Palabras de 1-2 letras
+        names = self._names
+        contains = [item_id for item_id in candidates if query in names[item_id]]
+        if contains:
+            # Primero los que empiezan con el texto y los nombres más cortos
+            key = lambda item_id: (not names[item_id].startswith(query), len(names[item_id]), item_id)
+            return heapq.nsmallest(limit, contains, key=key) if limit else sorted(contains, key=key)
+
+        # Similitud: los candidatos salen de los trigramas más raros de la consulta
+        # (los más comunes no discriminan y son los que tienen más ids)
+        ranked_grams = sorted((self._postings[gram] for gram in query_grams if gram in self._postings), key=len)
+        candidates = set()
+        for ids in ranked_grams:
+            if candidates and len(candidates) + len(ids) > self.max_candidates:
+                break
+            candidates.update(ids)
+        scored = []
+        for item_id in candidates:
+            score = 2 * len(query_grams & self._grams[item_id]) / (len(query_grams) + len(self._grams[item_id]))
+            if score >= min_score:
+                scored.append((-score, item_id))
+        return [item_id for _, item_id in heapq.nsmallest(limit, scored)]
+
+
+class ProductNameIndex:
+    """
+    TrigramIndex de una tabla de productos que se mantiene al día solo.
+
+    Cada `poll_interval` segundos consulta MAX(id) y COUNT(*): si solo
+    aparecieron productos nuevos los agrega; si la cuenta no cuadra (borrados)
+    o pasaron `rebuild_interval` segundos (renombres) lo reconstruye completo.
+    """
+
+    def __init__(self, run_query, table="product", id_column="id", name_column="name",
+                 placeholder="?", poll_interval=5, rebuild_interval=600):
+        self._run_query = run_query
+        # Identificadores fijos del código, nunca datos del usuario
+        self._all_sql = f"SELECT {id_column}, {name_column} FROM {table}"
+        self._new_sql = f"{self._all_sql} WHERE {id_column} > {placeholder}"
+        self._watermark_sql = f"SELECT MAX({id_column}), COUNT(*) FROM {table}"
+        self.poll_interval = poll_interval
+        self.rebuild_interval = rebuild_interval
+        self._index = TrigramIndex()
+        self._watermark = None
+        self._checked_at = None
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._stats = {"rebuilds": 0, "incremental_updates": 0, "errors": 0, "searches": 0}
+
+    def _rows(self, sql, params=()):
+        rows = self._run_query(sql, params)
+        if rows is None or isinstance(rows, str):
+            raise RuntimeError(f"No se pudo leer la tabla de productos: {rows}")
+        if getattr(rows, "truncated", False):
+            raise RuntimeError("El resultado se truncó; el índice quedaría incompleto")
+        return [tuple(row.values()) if isinstance(row, dict) else tuple(row) for row in rows]
+
+    def refresh(self, force=False):
+        with self._lock:
+            now = time.monotonic()
+            # Sin índice construido se reintenta siempre (un fallo no deja un índice vacío)
+            if (not force and self._built_at is not None
+                    and now - self._checked_at < self.poll_interval):
+                return
+            self._checked_at = now
+            try:
+                max_id, count = self._rows(self._watermark_sql)[0]
+                max_id, count = max_id or 0, count or 0
+                if (force or self._built_at is None
+                        or now - self._built_at >= self.rebuild_interval
+                        or count < len(self._index)):
+                    index = TrigramIndex()
+                    for item_id, name in self._rows(self._all_sql):
+                        index.add(item_id, name)
+                    self._index = index
+                    self._built_at = now
+                    self._stats["rebuilds"] += 1
+                elif (max_id, count) != self._watermark:
+                    for item_id, name in self._rows(self._new_sql, (self._watermark[0],)):
+                        self._index.add(item_id, name)
+                    self._stats["incremental_updates"] += 1
+                self._watermark = (max_id, count)
+            except Exception as e:
+                self._stats["errors"] += 1
+                if self._built_at is None:
+                    raise
+                print(f"Warning: No se pudo actualizar el índice de nombres: {e}")
+
+    def search(self, text, limit=5):
+        """Ids de los productos que mejor coinciden con `text`"""
+        self.refresh()
+        with self._lock:
+            self._stats["searches"] += 1
+            return self._index.search(text, limit)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, products=len(self._index))
+
+
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    # Catálogo sintético: palabras inventadas (como las marcas y variedades reales,
+    # casi todas distintas) más algunos nombres comunes con acentos
+    random.seed(11)
+    syllables = ["ba", "ca", "da", "fe", "gi", "lo", "ma", "ni", "po", "ra", "su", "ta", "vo", "za", "que", "chi"]
+    vocabulary = ["".join(random.choice(syllables) for _ in range(random.randint(2, 4))) for _ in range(4000)]
+    common = ["Arroz Tucapel grado 2", "Azúcar Iansa", "Café Nescafé Tradición", "Leche Colún entera",
+              "Plátano de Ecuador", "Atún Van Camp's en aceite", "Jamón de pavo San Jorge"]
+    queries = ["arroz tucapel", "azucar", "cafe nescafe", "lehce colun", "platano", "atun"]
+    for size in (10_000, 100_000):
+        index = TrigramIndex()
+        for i in range(size):
+            index.add(i, " ".join(random.sample(vocabulary, 3)) + f" {random.randint(1, 999)}g")
+        for i, name in enumerate(common, size):
+            index.add(i, name)
+        for query in queries:
+            seconds = min(timeit.repeat(lambda: index.search(query), number=50, repeat=3)) / 50
+            print(f"{size:>7,} nombres  {query!r:>16}: {seconds * 1000:6.3f} ms -> {index.search(query, 2)}")
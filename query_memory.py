@@ -0,0 +1,354 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos (un solo proceso debe escribir)
+    fcntl = None
+
+from intent_router import fold_accents
+
+# --- MEMORIA DE CONSULTAS (PREGUNTA -> SQL) ---
+# Guarda las preguntas que ya se resolvieron con SQL generado por Gemini junto
+# con su embedding. Una pregunta nueva suficientemente parecida reutiliza ese
+# SQL sin volver a llamar a Gemini. Los vectores viven en un archivo .npy
+# mapeado en memoria y los textos en un .jsonl al lado. Varios procesos (workers
+# de gunicorn, Streamlit y Flask) pueden compartir los archivos: las escrituras
+# toman un bloqueo de archivo y cada proceso incorpora lo que agregaron los demás.
+
+# Rutas relativas (incluida la de QUERY_MEMORY_PATH) se resuelven desde la carpeta
+# del proyecto y no desde el directorio de trabajo del proceso
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PATH = os.path.join(PROJECT_DIR, ".cache", "query_memory")
+
+
+def resolve_path(path):
+    """Ruta absoluta del índice (None o vacío = solo en memoria)"""
+    if not path:
+        return None
+    return os.path.join(PROJECT_DIR, os.path.expanduser(path))
+
+
+# Palabras de relleno: pesan poco para que "dime el ..." y "¿cuál es el ...?"
+# queden juntas y una palabra de contenido distinta separe las preguntas
+STOPWORDS = frozenset("""
+    a al como cual cuales cuanta cuantas cuanto cuantos de del dime el en es esta
+    estas este estos favor hay la las le lo los me mi mis muestrame o por que se
+    tengo tenemos un una unas unos y
+""".split())
+
+# Negaciones y comparaciones: cambian el SQL (NOT, <, >, ORDER BY ... DESC) con una
+# sola palabra, así que igual que las cifras deben coincidir para reutilizarlo
+MUST_MATCH_WORDS = frozenset("""
+    no sin nunca jamas ni tampoco excepto salvo menos mas mayor menor mayores menores
+    antes despues
+""".split())
+
+
+class HashEmbedder:
+    """
+    Embedding local y determinista (feature hashing de palabras y trigramas,
+    sin acentos). No usa red: sirve para pruebas y como opción por defecto.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def _features(self, text):
+        words = re.sub(r'[^\w\s]', ' ', fold_accents(text)).split()
+        for word in words:
+            if word in STOPWORDS:
+                yield word, 0.3
+                continue
+            yield word, 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3], 0.5
+
+    def __call__(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self._features(text):
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dim] += sign * weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class GeminiEmbedder:
+    """Embeddings de Gemini (text-embedding-004), con las protecciones de llm_client"""
+
+    def __init__(self, model="models/text-embedding-004", dim=768):
+        self.model = model
+        self.dim = dim
+
+    def __call__(self, text):
+        import google.generativeai as genai
+        import registry
+
+        # El modelo compartido aporta el rate limiting y el cortacircuitos del proceso
+        guard = registry.get_gemini_model('gemini-1.5-pro')
+        response = guard.call(genai.embed_content, model=self.model, content=text,
+                              task_type="retrieval_query")
+        vector = np.asarray(response["embedding"], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+EMBEDDERS = {"hash": HashEmbedder, "gemini": GeminiEmbedder}
+
+
+class VectorIndex:
+    """
+    Vectores normalizados en una matriz float32 (mapeada en disco si hay
+    `path`) con búsqueda top-k por similitud coseno (producto punto).
+    La capacidad se duplica al llenarse.
+
+    En disco, el .jsonl define cuántas filas valen. Las escrituras (y la
+    creación o el crecimiento del .npy) se hacen con un bloqueo exclusivo
+    sobre `{path}.lock`, después de incorporar las filas que otros procesos
+    agregaron; las búsquedas incorporan las líneas completas sin bloquear.
+    """
+
+    def __init__(self, dim, path=None, capacity=256):
+        self.dim = dim
+        self.path = path
+        self.records = []
+        self._meta_offset = 0
+        self._vectors_inode = None
+        if not path:
+            self._vectors = self._allocate(capacity)
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._file_lock():
+            if os.path.exists(self._meta_path) and os.path.exists(self._vectors_path):
+                self._load()
+            else:
+                self._create(capacity)
+
+    @property
+    def _vectors_path(self):
+        return f"{self.path}.vectors.npy"
+
+    @property
+    def _meta_path(self):
+        return f"{self.path}.meta.jsonl"
+
+    @contextmanager
+    def _file_lock(self):
+        if not self.path or fcntl is None:
+            yield
+            return
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _allocate(self, capacity, target=None):
+        if not self.path:
+            return np.zeros((capacity, self.dim), dtype=np.float32)
+        return np.lib.format.open_memmap(target or self._vectors_path, mode='w+',
+                                         dtype=np.float32, shape=(capacity, self.dim))
+
+    def _create(self, capacity):
+        self._vectors = self._allocate(capacity)
+        self._vectors_inode = os.stat(self._vectors_path).st_ino
+        # El .jsonl vacío marca el índice como creado para los demás procesos
+        open(self._meta_path, 'w', encoding='utf-8').close()
+        self.records = []
+        self._meta_offset = 0
+
+    def _open_vectors(self):
+        self._vectors = np.lib.format.open_memmap(self._vectors_path, mode='r+')
+        self._vectors_inode = os.stat(self._vectors_path).st_ino
+
+    def _load(self):
+        self._open_vectors()
+        self.records = []
+        self._meta_offset = 0
+        self._read_new_records()
+        if self._vectors.shape[1] != self.dim or len(self.records) > self._vectors.shape[0]:
+            print(f"Warning: Índice de vectores incompatible en {self.path}, se crea uno nuevo")
+            self._vectors = None
+            self._create(256)
+
+    def _read_new_records(self):
+        """Agregar las líneas completas del .jsonl escritas desde la última lectura"""
+        with open(self._meta_path, 'rb') as f:
+            f.seek(self._meta_offset)
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                self.records.append(json.loads(line))
+        self._meta_offset += len(complete)
+
+    def sync(self):
+        """Incorporar las filas y el crecimiento del .npy hechos por otros procesos"""
+        if not self.path:
+            return
+        try:
+            meta_size = os.path.getsize(self._meta_path)
+            vectors_inode = os.stat(self._vectors_path).st_ino
+        except FileNotFoundError:
+            return
+        if meta_size < self._meta_offset:
+            self._load()  # Otro proceso recreó el índice
+            return
+        if meta_size > self._meta_offset:
+            self._read_new_records()
+        # Quien crece el .npy lo reemplaza antes de escribir la línea de la fila
+        # nueva, así que abrirlo después de leer el .jsonl alcanza para todas
+        if vectors_inode != self._vectors_inode or len(self.records) > self._vectors.shape[0]:
+            self._open_vectors()
+
+    def __len__(self):
+        return len(self.records)
+
+    def _grow(self):
+        capacity = self._vectors.shape[0] * 2
+        if not self.path:
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            grown[:len(self.records)] = self._vectors[:len(self.records)]
+            self._vectors = grown
+            return
+        tmp_path = f"{self._vectors_path}.tmp"
+        grown = self._allocate(capacity, target=tmp_path)
+        grown[:len(self.records)] = self._vectors[:len(self.records)]
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_path, self._vectors_path)
+        self._open_vectors()
+
+    def add(self, vector, record):
+        with self._file_lock():
+            self.sync()
+            if len(self.records) == self._vectors.shape[0]:
+                self._grow()
+            self._vectors[len(self.records)] = vector
+            if self.path:
+                # Primero el vector y después el texto: el .jsonl define cuántas filas valen
+                self._vectors.flush()
+                line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+                with open(self._meta_path, 'ab') as f:
+                    f.write(line)
+                self._meta_offset += len(line)
+            self.records.append(record)
+
+    def search(self, vector, k=3):
+        """[(similitud, registro)] de los k vectores más parecidos"""
+        self.sync()
+        count = len(self.records)
+        if count == 0:
+            return []
+        scores = self._vectors[:count] @ vector
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.records[i]) for i in top]
+
+
+class QueryMemory:
+    """Pares (pregunta, SQL) exitosos recuperables por similitud de la pregunta"""
+
+    def __init__(self, embedder=None, path=None, threshold=0.9):
+        self.embedder = embedder or HashEmbedder()
+        self.threshold = threshold
+        self._index = VectorIndex(self.embedder.dim, path)
+        self._known = set()
+        self._known_count = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0}
+
+    def _sync_known(self):
+        """Incorporar las preguntas guardadas por otros procesos (con el lock tomado)"""
+        self._index.sync()
+        for record in self._index.records[self._known_count:]:
+            self._known.add(record["key"])
+        self._known_count = len(self._index.records)
+
+    @staticmethod
+    def _key(question):
+        return ' '.join(re.sub(r'[^\w\s]', ' ', fold_accents(question)).split())
+
+    @staticmethod
+    def _signature(question):
+        """Cifras y palabras de MUST_MATCH_WORDS de la pregunta"""
+        words = re.sub(r'[^\w\s]', ' ', fold_accents(question)).split()
+        return (sorted(re.findall(r'\d+', question)),
+                sorted(word for word in words if word in MUST_MATCH_WORDS))
+
+    def lookup(self, question):
+        """SQL de la pregunta guardada más parecida, o None si ninguna supera el umbral"""
+        vector = self.embedder(question)
+        # Las cifras suelen terminar como literales en el SQL ("stock menor a 10") y
+        # una negación o comparación lo invierte: solo se reutiliza si coinciden
+        signature = self._signature(question)
+        with self._lock:
+            for score, record in self._index.search(vector, k=3):
+                if score < self.threshold:
+                    break
+                if self._signature(record["question"]) == signature:
+                    self._stats["hits"] += 1
+                    return record["sql"]
+            self._stats["misses"] += 1
+            return None
+
+    def remember(self, question, sql):
+        """Guardar un par que funcionó (las preguntas repetidas se ignoran)"""
+        key = self._key(question)
+        with self._lock:
+            self._sync_known()
+            if key in self._known:
+                return
+        vector = self.embedder(question)
+        with self._lock:
+            self._sync_known()
+            if key in self._known:
+                return
+            self._index.add(vector, {"key": key, "question": question, "sql": sql})
+            self._sync_known()
+            self._stats["stored"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._index))
+
+
+if __name__ == "__main__":
+    import tempfile
+    import timeit
+
+    # Demostración con el embedder local: guardar, recargar desde disco y buscar
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = QueryMemory(path=os.path.join(tmp, "consultas"))
+        memory.remember("¿Cuál es el producto más vendido este mes?",
+                        "SELECT p.nombre, SUM(m.cantidad) AS vendidos FROM movimientos_inventario m "
+                        "JOIN productos p ON m.id_producto = p.id WHERE m.tipo_movimiento = 'salida' "
+                        "GROUP BY p.nombre ORDER BY vendidos DESC LIMIT 1")
+        memory.remember("Productos con stock menor a 10 unidades",
+                        "SELECT nombre, cantidad FROM productos WHERE cantidad < 10 LIMIT 50")
+        for i in range(2000):
+            memory.remember(f"pregunta de relleno número {i}", f"SELECT {i}")
+
+        reloaded = QueryMemory(path=os.path.join(tmp, "consultas"))
+        memory.remember("¿Qué artículos se vendieron este mes?", "SELECT DISTINCT id_producto FROM movimientos_inventario")
+        for question in ["cual es el producto mas vendido este mes", "producto más vendido del mes",
+                         "¿Qué artículos no se vendieron este mes?",
+                         "¿Cuál es el producto menos vendido este mes?",
+                         "productos con stock menor a 10 unidades", "productos con stock menor a 20 unidades",
+                         "¿Qué proveedor entrega más rápido?"]:
+            print(f"{question!r}: {reloaded.lookup(question)}")
+        seconds = min(timeit.repeat(lambda: reloaded.lookup("producto más vendido del mes"),
+                                    number=200, repeat=3)) / 200
+        print(f"{len(reloaded._index)} preguntas guardadas, búsqueda: {seconds * 1000:.3f} ms")
@@ -0,0 +1,60 @@
+import os
+import threading
+
+# Registro de configuración y clientes compartidos por todo el proceso.
+# Nada se lee ni se construye al importar: cada recurso se crea en su primer
+# uso y se reutiliza después, para que importar app, services o
+# database_agent no haga I/O (arranques en frío más rápidos).
+_lock = threading.RLock()
+_state = {"env_loaded": False, "gemini_configured": False}
+_db_configs = {}
+_models = {}
+
+
+def load_env():
+    """Cargar el archivo .env una sola vez por proceso"""
+    with _lock:
+        if not _state["env_loaded"]:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _state["env_loaded"] = True
+
+
+def get_db_config(secrets_path='.streamlit/secrets.toml'):
+    """Configuración de MySQL leída de secrets.toml (se lee una sola vez)"""
+    with _lock:
+        if secrets_path not in _db_configs:
+            try:
+                import toml
+                with open(secrets_path, 'r') as f:
+                    secrets = toml.load(f)
+                _db_configs[secrets_path] = secrets['connections']['mysql']
+            except Exception as e:
+                raise Exception(f"Error cargando configuración de BD: {e}")
+        return _db_configs[secrets_path]
+
+
+def get_gemini_model(model_name, **model_kwargs):
+    """
+    Modelo de Gemini compartido (envuelto en ResilientModel), creado en el
+    primer uso. google.generativeai se importa y configura solo entonces.
+    """
+    key = (model_name, repr(sorted(model_kwargs.items())))
+    with _lock:
+        if key not in _models:
+            load_env()
+            import google.generativeai as genai
+            from llm_client import ResilientModel
+            if not _state["gemini_configured"]:
+                genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
+                _state["gemini_configured"] = True
+            _models[key] = ResilientModel(genai.GenerativeModel(model_name=model_name, **model_kwargs))
+        return _models[key]
+
+
+def reset():
+    """Olvidar la configuración y los clientes creados (útil en pruebas)"""
+    with _lock:
+        _state.update({"env_loaded": False, "gemini_configured": False})
+        _db_configs.clear()
+        _models.clear()
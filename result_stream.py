@@ -0,0 +1,109 @@
+import sys
+from collections.abc import Sequence
+
+# --- LECTURA DE RESULTADOS POR LOTES ---
+# Los resultados se leen del cursor con fetchmany (sin traer todo el conjunto
+# a memoria de una vez), se guardan como tuplas junto con los nombres de las
+# columnas y solo se convierten en diccionarios cuando alguien los consume.
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def row_bytes(row):
+    """Tamaño aproximado en memoria de una fila (tupla más sus valores)"""
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+def column_names(cursor):
+    return tuple(col[0] for col in cursor.description) if cursor.description else ()
+
+
+def stream_rows(cursor, batch_size=DEFAULT_BATCH_SIZE, max_rows=None, max_bytes=None, on_truncate=None):
+    """
+    Generador de filas (tuplas) leídas en lotes de `batch_size`.
+
+    Se detiene al llegar a `max_rows` filas o `max_bytes` bytes aproximados;
+    en ese caso descarta el resto del resultado lote a lote (un cursor sin
+    buffer de MySQL exige leerlo entero antes de reutilizar la conexión) y
+    llama a `on_truncate()`.
+    """
+    count = 0
+    size = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        for row in batch:
+            if not isinstance(row, tuple):
+                row = tuple(row.values()) if isinstance(row, dict) else tuple(row)
+            if max_bytes is not None:
+                size += row_bytes(row)
+            if (max_rows is not None and count >= max_rows) or (max_bytes is not None and size > max_bytes):
+                while cursor.fetchmany(batch_size):
+                    pass
+                if on_truncate:
+                    on_truncate()
+                return
+            count += 1
+            yield row
+
+
+class ResultSet(Sequence):
+    """
+    Resultado de una consulta guardado como tuplas más los nombres de columna.
+
+    Se comporta como una lista de diccionarios (índices, slices, iteración,
+    len) creando cada diccionario al acceder a él, así que los consumidores
+    existentes no cambian y la memoria retenida (por ejemplo en cachés) es la
+    de las tuplas. `truncated` indica que se alcanzó el límite de filas o bytes.
+    """
+
+    __slots__ = ("columns", "rows", "truncated", "_nbytes")
+
+    def __init__(self, columns, rows, truncated=False):
+        self.columns = tuple(columns)
+        self.rows = rows
+        self.truncated = truncated
+        self._nbytes = None
+
+    @property
+    def nbytes(self):
+        """Tamaño aproximado de las filas en memoria (calculado una sola vez)"""
+        if self._nbytes is None:
+            self._nbytes = sum(row_bytes(row) for row in self.rows)
+        return self._nbytes
+
+    def _as_dict(self, row):
+        return dict(zip(self.columns, row))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._as_dict(row) for row in self.rows[index]]
+        return self._as_dict(self.rows[index])
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def as_dicts(self):
+        """Materializar como lista de diccionarios (solo en el borde: UI, JSON)"""
+        return list(self)
+
+    def __repr__(self):
+        suffix = ", truncated" if self.truncated else ""
+        return f"ResultSet({len(self.rows)} filas x {len(self.columns)} columnas{suffix})"
+
+
+def fetch_result(cursor, batch_size=DEFAULT_BATCH_SIZE, max_rows=None, max_bytes=None):
+    """Leer el resultado del cursor ya ejecutado en un ResultSet con los límites dados"""
+    truncated = []
+    rows = list(stream_rows(cursor, batch_size, max_rows, max_bytes,
+                            on_truncate=lambda: truncated.append(True)))
+    result = ResultSet(column_names(cursor), rows, truncated=bool(truncated))
+    if result.truncated:
+        print(f"Warning: Resultado truncado a {len(rows)} filas (límite de filas o bytes)")
+    return result
@@ -1,11 +1,16 @@
 import os
-import google.generativeai as genai
 import sqlite3
 import json
 import re
-
-# Configurar la API de Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+import threading
+import time
+from collections import OrderedDict
+from intent_router import CHAT_ROUTER, fold_accents
+from llm_client import LLMUnavailableError, ResilientModel, estimate_tokens
+from result_stream import fetch_result
+from answer_format import block, project, render
+from name_index import ProductNameIndex
+import registry
 
 # Configuración del modelo
 generation_config = {
@@ -23,13 +28,169 @@ safety_settings = [
   # ... (puedes añadir más configuraciones de seguridad)
 ]
 
-model = genai.GenerativeModel(model_name="gemini-2.5-flash",
-                              generation_config=generation_config,
-                              safety_settings=safety_settings)
+# Instrucciones del asistente: van una sola vez como system_instruction del
+# modelo en lugar de repetirse dentro de cada mensaje
+CHAT_SYSTEM_PROMPT = """Eres un asistente de ventas útil y amigable. 
+Responde de forma concisa y profesional. 
+Si el usuario pregunta por productos específicos, stock, precios o inventario, 
+menciona que pueden hacer consultas específicas sobre productos disponibles."""
+
+SUMMARY_PROMPT = """Resume la siguiente conversación entre un usuario y un asistente de ventas
+en un párrafo breve. Conserva los productos, cantidades y precios mencionados
+y lo que el usuario quiere lograr.
+
+{conversation}"""
+
+def get_model():
+    """
+    Modelo de Gemini del chat, creado (y Gemini configurado) en el primer uso
+    para que importar este módulo no haga I/O.
+    """
+    return registry.get_gemini_model("gemini-2.5-flash",
+                                     generation_config=generation_config,
+                                     safety_settings=safety_settings,
+                                     system_instruction=CHAT_SYSTEM_PROMPT)
+
+UNAVAILABLE_REPLY = ("El asistente no está disponible en este momento. "
+                     "Puedes seguir consultando stock, precios o productos específicos.")
+
 
-def execute_database_query(query):
+class StreamFailure(str):
     """
-    Ejecuta una consulta SQL en la base de datos y devuelve los resultados.
+    Mensaje de error emitido por stream_ai_response: no es parte de la
+    respuesta (puede llegar después de fragmentos ya enviados), así que el
+    llamador debe mostrarlo aparte.
+    """
+
+# --- SESIONES DE CHAT POR USUARIO ---
+class ChatSession:
+    """
+    Historial acotado de la conversación de un usuario: un resumen de los
+    turnos antiguos más los mensajes recientes, en el formato de start_chat.
+    """
+
+    def __init__(self):
+        self.summary = ""
+        self.messages = []
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def history(self):
+        """Historial para start_chat (el resumen va como primer intercambio)"""
+        history = []
+        if self.summary:
+            history.append({"role": "user", "parts": [f"Resumen de la conversación anterior: {self.summary}"]})
+            history.append({"role": "model", "parts": ["Entendido, continúo a partir de ese contexto."]})
+        return history + list(self.messages)
+
+    def tokens(self):
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(part) for message in self.messages for part in message["parts"]
+        )
+
+class ChatSessionStore:
+    """
+    Sesiones de chat por usuario con expulsión LRU de las inactivas.
+
+    Cada turno guarda el mensaje y la respuesta (también las que salen de la
+    base de datos, para que las preguntas de seguimiento tengan los datos a
+    mano). Cuando el historial supera `token_budget` o `max_messages`, la
+    mitad más antigua se condensa en un resumen.
+    """
+
+    def __init__(self, max_sessions=500, idle_ttl=1800, token_budget=2000, max_messages=20):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "summaries": 0}
+
+    def get(self, user_id):
+        """Sesión del usuario (se crea si no existe o expiró por inactividad)"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(user_id)
+            if session is not None and now - session.last_used > self.idle_ttl:
+                del self._sessions[user_id]
+                self._stats["expired"] += 1
+                session = None
+            if session is None:
+                self._stats["misses"] += 1
+                session = ChatSession()
+                self._sessions[user_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self._stats["evictions"] += 1
+            else:
+                self._stats["hits"] += 1
+                self._sessions.move_to_end(user_id)
+            session.last_used = now
+            return session
+
+    def record(self, session, message, reply, llm=None):
+        """Agregar un turno y resumir el historial si excede el presupuesto"""
+        with session.lock:
+            session.messages.append({"role": "user", "parts": [message]})
+            session.messages.append({"role": "model", "parts": [reply]})
+            if session.tokens() > self.token_budget or len(session.messages) > self.max_messages:
+                self._summarize(session, llm)
+
+    def _summarize(self, session, llm):
+        # Turnos completos (pares usuario/modelo) de la mitad más antigua
+        cut = max(2, len(session.messages) // 2 // 2 * 2)
+        old, session.messages = session.messages[:cut], session.messages[cut:]
+        conversation = "\n".join(
+            f"{'Usuario' if m['role'] == 'user' else 'Asistente'}: {m['parts'][0]}" for m in old
+        )
+        if session.summary:
+            conversation = f"Resumen previo: {session.summary}\n{conversation}"
+        try:
+            if llm is None:
+                raise LLMUnavailableError("Sin modelo para resumir")
+            response = llm.generate_content(SUMMARY_PROMPT.format(conversation=conversation))
+            session.summary = response.text.strip()
+        except Exception as e:
+            # Sin Gemini: conservar el texto recortado al presupuesto en lugar de perderlo
+            print(f"Warning: No se pudo resumir el historial del chat: {e}")
+            session.summary = conversation[-self.token_budget * 2:]
+        with self._lock:
+            self._stats["summaries"] += 1
+
+    def clear(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions))
+
+_session_store = None
+_session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Almacén de sesiones del proceso, creado en el primer uso con la configuración de .env"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            registry.load_env()
+            _session_store = ChatSessionStore(
+                max_sessions=int(os.getenv('CHAT_MAX_SESSIONS', 500)),
+                idle_ttl=float(os.getenv('CHAT_SESSION_TTL', 1800)),
+                token_budget=int(os.getenv('CHAT_HISTORY_TOKENS', 2000)),
+                max_messages=int(os.getenv('CHAT_MAX_MESSAGES', 20)),
+            )
+        return _session_store
+
+# --- CONSULTAS A LA BASE DE DATOS ---
+def execute_database_query(query, params=(), capped=True):
+    """
+    Ejecuta una consulta SQL parametrizada en la base de datos y devuelve los resultados.
+    Con `capped=False` no se aplican los límites de filas y bytes (índices en memoria).
     """
     try:
         # Obtener la ruta absoluta del directorio del proyecto
@@ -37,68 +198,114 @@ def execute_database_query(query):
         db_path = os.path.join(basedir, 'app.db')
         
         conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # Para obtener resultados como diccionarios
         cursor = conn.cursor()
         
-        cursor.execute(query)
-        results = cursor.fetchall()
-        
-        # Convertir a lista de diccionarios
-        results_list = [dict(row) for row in results]
+        cursor.execute(query, params)
+        # Lectura por lotes con límite de filas; las filas se ven como diccionarios al usarlas
+        if capped:
+            results = fetch_result(cursor, max_rows=int(os.getenv('RESULT_MAX_ROWS', 5000)),
+                                   max_bytes=int(os.getenv('RESULT_MAX_BYTES', 8 * 1024 * 1024)))
+        else:
+            results = fetch_result(cursor)
         
         conn.close()
-        return results_list
+        return results
         
     except Exception as e:
         print(f"Error al ejecutar consulta: {e}")
         return None
 
+# --- BÚSQUEDA DE PRODUCTOS POR NOMBRE ---
+PRODUCT_NAME_RE = re.compile(r'producto\s+([\w\s]+)')
+PRODUCT_MATCH_LIMIT = 20
+
+_name_index = None
+_name_index_lock = threading.Lock()
+
+def get_name_index():
+    """Índice de trigramas de product.name, creado en el primer uso"""
+    global _name_index
+    with _name_index_lock:
+        if _name_index is None:
+            registry.load_env()
+            _name_index = ProductNameIndex(
+                # Sin límite de filas: un índice truncado daría "no encontrado" para el resto
+                lambda query, params=(): execute_database_query(query, params, capped=False),
+                poll_interval=int(os.getenv('WATERMARK_POLL_INTERVAL', 5)),
+            )
+        return _name_index
+
+def _product_filter(columns, product_name):
+    """
+    Consulta y parámetros para los productos que coinciden con `product_name`:
+    ids exactos desde el índice de nombres (en orden de relevancia) o, si el
+    índice no está disponible, el LIKE anterior. None si no hay coincidencias.
+    """
+    try:
+        ids = get_name_index().search(product_name, PRODUCT_MATCH_LIMIT)
+    except Exception as e:
+        print(f"Warning: Índice de nombres no disponible, usando LIKE: {e}")
+        return f"SELECT {columns} FROM product WHERE LOWER(name) LIKE ?", (f"%{product_name}%",)
+    if not ids:
+        return None, ()
+    placeholders = ", ".join("?" * len(ids))
+    ranking = " ".join(f"WHEN ? THEN {rank}" for rank in range(len(ids)))
+    query = (f"SELECT {columns} FROM product WHERE id IN ({placeholders}) "
+             f"ORDER BY CASE id {ranking} END")
+    return query, tuple(ids) * 2
+
 def analyze_user_intent(message):
     """
     Analiza el mensaje del usuario para determinar si necesita consultar la base de datos
-    y generar la consulta SQL apropiada.
+    y generar la consulta SQL apropiada. Devuelve (tipo, consulta, parámetros); la
+    consulta es None cuando se pidió un producto que no existe.
     """
-    message_lower = message.lower()
-    
-    # Patrones comunes para consultas de productos
-    stock_patterns = ['stock', 'inventario', 'cantidad', 'cuántos', 'cuantos']
-    price_patterns = ['precio', 'costo', 'vale', 'cuesta']
-    product_patterns = ['producto', 'artículo', 'item']
+    intent = CHAT_ROUTER.classify(message)
+    # Nombre del producto sin acentos ("azúcar" -> "azucar"), como en el índice
+    product_match = PRODUCT_NAME_RE.search(fold_accents(message)) if intent in ('stock', 'price') else None
     
     # Verificar si es una consulta de stock
-    if any(pattern in message_lower for pattern in stock_patterns):
-        # Extraer el nombre del producto
-        product_match = re.search(r'producto\s+([a-zA-Z0-9\s]+)', message_lower)
+    if intent == 'stock':
         if product_match:
-            product_name = product_match.group(1).strip()
-            query = f"SELECT name, stock FROM product WHERE LOWER(name) LIKE '%{product_name}%'"
-            return 'stock', query
+            query, params = _product_filter("name, stock", product_match.group(1).strip())
+            return 'stock', query, params
         else:
             # Buscar todos los stocks
             query = "SELECT name, stock FROM product ORDER BY name"
-            return 'stock_all', query
+            return 'stock_all', query, ()
     
     # Verificar si es una consulta de precio
-    elif any(pattern in message_lower for pattern in price_patterns):
-        product_match = re.search(r'producto\s+([a-zA-Z0-9\s]+)', message_lower)
+    elif intent == 'price':
         if product_match:
-            product_name = product_match.group(1).strip()
-            query = f"SELECT name, price FROM product WHERE LOWER(name) LIKE '%{product_name}%'"
-            return 'price', query
+            query, params = _product_filter("name, price", product_match.group(1).strip())
+            return 'price', query, params
         else:
             query = "SELECT name, price FROM product ORDER BY name"
-            return 'price_all', query
+            return 'price_all', query, ()
     
     # Verificar si es una consulta general de productos
-    elif any(pattern in message_lower for pattern in product_patterns):
+    elif intent == 'product':
         query = "SELECT * FROM product ORDER BY name"
-        return 'products', query
+        return 'products', query, ()
     
-    return None, None
+    return None, None, ()
+
+# Plantillas de las líneas de format_database_response (str.format ya ligado)
+STOCK_LINE = "• {}: {} unidades".format
+SOLD_OUT_LINE = "• {}: AGOTADO".format
+PRICE_LINE = "• {}: ${:.2f}".format
+PRODUCT_LINE = "• {}: ${:.2f} - Stock: {} unidades".format
+PRODUCT_SOLD_OUT_LINE = "• {}: ${:.2f} - Stock: AGOTADO".format
+
+def _stock_lines(results):
+    return [STOCK_LINE(name, stock) if stock > 0 else SOLD_OUT_LINE(name)
+            for name, stock in project(results, ('name', 'stock'))]
 
 def format_database_response(query_type, results):
     """
     Formatea los resultados de la base de datos en una respuesta legible.
+    Las líneas se generan con plantillas directamente desde las columnas y se
+    unen con un solo join, así que el costo crece linealmente con el catálogo.
     """
     if not results:
         return "No se encontraron resultados en la base de datos."
@@ -111,84 +318,137 @@ def format_database_response(query_type, results):
             else:
                 return f"El {product['name']} está agotado (0 unidades en stock)."
         else:
-            response = "Stock de productos encontrados:\n"
-            for product in results:
-                status = f"{product['stock']} unidades" if product['stock'] > 0 else "AGOTADO"
-                response += f"• {product['name']}: {status}\n"
-            return response
+            response = "Stock de productos encontrados:\n" + block(_stock_lines(results))
     
     elif query_type == 'stock_all':
-        response = "Stock de todos los productos:\n"
-        for product in results:
-            status = f"{product['stock']} unidades" if product['stock'] > 0 else "AGOTADO"
-            response += f"• {product['name']}: {status}\n"
-        return response
+        response = "Stock de todos los productos:\n" + block(_stock_lines(results))
     
     elif query_type == 'price':
         if len(results) == 1:
             product = results[0]
             return f"El precio del {product['name']} es ${product['price']:.2f}"
         else:
-            response = "Precios de productos encontrados:\n"
-            for product in results:
-                response += f"• {product['name']}: ${product['price']:.2f}\n"
-            return response
+            response = "Precios de productos encontrados:\n" + render(PRICE_LINE, project(results, ('name', 'price')))
     
     elif query_type == 'price_all':
-        response = "Precios de todos los productos:\n"
-        for product in results:
-            response += f"• {product['name']}: ${product['price']:.2f}\n"
-        return response
+        response = "Precios de todos los productos:\n" + render(PRICE_LINE, project(results, ('name', 'price')))
     
     elif query_type == 'products':
-        response = "Información de productos:\n"
-        for product in results:
-            stock_info = f"{product['stock']} unidades" if product['stock'] > 0 else "AGOTADO"
-            response += f"• {product['name']}: ${product['price']:.2f} - Stock: {stock_info}\n"
-        return response
+        lines = [PRODUCT_LINE(name, price, stock) if stock > 0 else PRODUCT_SOLD_OUT_LINE(name, price)
+                 for name, price, stock in project(results, ('name', 'price', 'stock'))]
+        response = "Información de productos:\n" + block(lines)
+    
+    else:
+        return "Información encontrada en la base de datos."
+    
+    if getattr(results, 'truncated', False):
+        response += f"\n(Se muestran solo los primeros {len(results)} resultados.)"
+    return response
+
+def _answer_from_database(message):
+    """
+    Responde directamente desde la base de datos si el mensaje lo requiere.
+    Devuelve None cuando la pregunta debe ir a Gemini.
+    """
+    query_type, sql_query, params = analyze_user_intent(message)
+    
+    if not query_type:
+        return None
     
-    return "Información encontrada en la base de datos."
+    # Sin consulta: el índice de nombres no encontró el producto
+    db_results = None
+    if sql_query:
+        print(f"Ejecutando consulta SQL: {sql_query} {params}")
+        db_results = execute_database_query(sql_query, params)
+    
+    if db_results:
+        # Formatear respuesta con datos de la base de datos
+        db_response = format_database_response(query_type, db_results)
+        print(f"Respuesta de la base de datos: {db_response}")
+        return db_response
+    return "No se encontró información sobre ese producto en nuestra base de datos."
+
+def _send_message(llm, convo, prompt, **kwargs):
+    """
+    Envía un mensaje al chat pasando por las protecciones de ResilientModel
+    (rate limiting, reintentos, cortacircuitos) cuando el modelo las tiene.
+    """
+    if isinstance(llm, ResilientModel):
+        return llm.call(convo.send_message, prompt, **kwargs)
+    return convo.send_message(prompt, **kwargs)
 
-def get_ai_response(message):
+def _chat_session(user_id):
+    """Sesión del usuario, o None para usuarios anónimos (sin historial)"""
+    return get_session_store().get(user_id) if user_id is not None else None
+
+def _remember(session, message, reply, llm=None):
+    if session is not None:
+        get_session_store().record(session, message, reply, llm)
+
+def get_ai_response(message, user_id=None):
     """
     Toma un mensaje de texto y devuelve una respuesta generada por Gemini,
     incluyendo consultas a la base de datos cuando sea necesario.
+    Con `user_id` la conversación continúa la sesión de ese usuario.
     """
     print(f"Mensaje recibido para Gemini: {message}")
     
     try:
-        # Primero, verificar si necesita consultar la base de datos
-        query_type, sql_query = analyze_user_intent(message)
-        
-        if query_type and sql_query:
-            print(f"Ejecutando consulta SQL: {sql_query}")
-            db_results = execute_database_query(sql_query)
-            
-            if db_results:
-                # Formatear respuesta con datos de la base de datos
-                db_response = format_database_response(query_type, db_results)
-                print(f"Respuesta de la base de datos: {db_response}")
-                return db_response
-            else:
-                return "No se encontró información sobre ese producto en nuestra base de datos."
+        session = _chat_session(user_id)
         
-        # Si no necesita consultar la base de datos, usar Gemini normalmente
-        convo = model.start_chat(history=[])
-        
-        # Mejorar el prompt para darle más contexto al modelo
-        prompt = f"""Eres un asistente de ventas útil y amigable. 
-        Responde de forma concisa y profesional. 
-        Si el usuario pregunta por productos específicos, stock, precios o inventario, 
-        menciona que pueden hacer consultas específicas sobre productos disponibles.
-        
-        El usuario dice: '{message}'"""
+        # Primero, verificar si necesita consultar la base de datos
+        db_response = _answer_from_database(message)
+        if db_response is not None:
+            _remember(session, message, db_response)
+            return db_response
         
-        convo.send_message(prompt)
+        # Si no necesita consultar la base de datos, continuar la conversación con Gemini
+        model = get_model()
+        convo = model.start_chat(history=session.history() if session else [])
+        _send_message(model, convo, message)
         reply = convo.last.text
+        _remember(session, message, reply, model)
         
         print(f"Respuesta de Gemini: {reply}")
         return reply
         
+    except LLMUnavailableError as e:
+        print(f"Gemini no disponible: {e}")
+        return UNAVAILABLE_REPLY
+    except Exception as e:
+        print(f"Error al procesar la solicitud: {e}")
+        return "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo."
+
+def stream_ai_response(message, chat_model=None, user_id=None):
+    """
+    Versión por fragmentos de get_ai_response: genera el texto a medida que
+    Gemini lo produce. `chat_model` permite inyectar un modelo falso que
+    devuelva un generador de fragmentos (útil para pruebas sin red).
+    """
+    print(f"Mensaje recibido para Gemini (streaming): {message}")
+    
+    try:
+        session = _chat_session(user_id)
+        
+        db_response = _answer_from_database(message)
+        if db_response is not None:
+            _remember(session, message, db_response)
+            yield db_response
+            return
+        
+        llm = chat_model or get_model()
+        convo = llm.start_chat(history=session.history() if session else [])
+        chunks = []
+        for chunk in _send_message(llm, convo, message, stream=True):
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        # Solo las respuestas completas entran al historial
+        _remember(session, message, "".join(chunks), llm)
+        
+    except LLMUnavailableError as e:
+        print(f"Gemini no disponible: {e}")
+        yield StreamFailure(UNAVAILABLE_REPLY)
     except Exception as e:
         print(f"Error al procesar la solicitud: {e}")
-        return "Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo."
\ No newline at end of file
+        yield StreamFailure("Hubo un error al procesar tu solicitud. Por favor, inténtalo de nuevo.")
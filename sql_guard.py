@@ -0,0 +1,203 @@
+import re
+
+# --- VALIDACIÓN DEL SQL GENERADO POR GEMINI ---
+# Antes de ejecutar una consulta escrita por el modelo se comprueba que sea
+# una sola sentencia SELECT de solo lectura, con LIMIT acotado, sin joins
+# sin condición y con un tiempo máximo de ejecución en el servidor.
+
+# REPLACE() e INSERT() también son funciones de texto, pero una sentencia que
+# empieza con SELECT no puede modificar datos salvo con INTO o bloqueos
+FORBIDDEN_KEYWORDS = {
+    "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "TRUNCATE", "RENAME",
+    "GRANT", "REVOKE", "LOCK", "UNLOCK", "CALL", "HANDLER", "INTO", "OUTFILE",
+    "DUMPFILE", "LOAD_FILE", "SLEEP", "BENCHMARK", "GET_LOCK", "SHUTDOWN", "KILL",
+}
+
+# Cláusulas que cierran la lista de tablas de un FROM/JOIN
+_CLAUSE_END = {"WHERE", "GROUP", "HAVING", "ORDER", "LIMIT", "UNION", "WINDOW", "FOR"}
+
+# STRAIGHT_JOIN de MySQL es un JOIN con orden fijo; tras SELECT (o sus
+# modificadores) es en cambio una opción de la sentencia
+_JOIN_WORDS = {"JOIN", "STRAIGHT_JOIN"}
+_SELECT_MODIFIERS = {"SELECT", "ALL", "DISTINCT", "DISTINCTROW", "HIGH_PRIORITY"}
+
+_TOKEN_RE = re.compile(r"""
+    (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`[^`]*`)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<space>\s+)
+  | (?P<operator><=>|->>|<=|>=|<>|!=|:=|\|\||&&|->)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+
+class UnsafeQueryError(ValueError):
+    """El SQL generado no pasó la validación y no debe ejecutarse"""
+
+
+def _tokenize(sql):
+    """
+    Tokens (tipo, texto, profundidad de paréntesis, inicio, fin) sin
+    comentarios ni espacios; inicio y fin son posiciones en `sql`.
+    """
+    tokens = []
+    depth = 0
+    for match in _TOKEN_RE.finditer(sql):
+        kind, text = match.lastgroup, match.group()
+        if kind in ("comment", "space"):
+            continue
+        if text == ")":
+            depth -= 1
+            if depth < 0:
+                raise UnsafeQueryError("Paréntesis desbalanceados")
+        tokens.append((kind, text, depth, match.start(), match.end()))
+        if text == "(":
+            depth += 1
+    if depth != 0:
+        raise UnsafeQueryError("Paréntesis desbalanceados")
+    return tokens
+
+
+def _splice(sql, edits):
+    """Aplicar reemplazos (inicio, fin, texto) sobre el SQL original"""
+    for start, end, text in sorted(edits, reverse=True):
+        sql = sql[:start] + text + sql[end:]
+    return sql
+
+
+def _check_joins(tokens):
+    """
+    Rechazar CROSS JOIN, JOIN/STRAIGHT_JOIN sin ON/USING y tablas separadas
+    por comas: un WHERE cualquiera no garantiza que relacione las tablas, así
+    que se exigen joins explícitos.
+    """
+    words = [(text.upper() if kind == "word" else text, depth) for kind, text, depth, _, _ in tokens]
+    for i, (word, depth) in enumerate(words):
+        if word == "CROSS":
+            raise UnsafeQueryError("CROSS JOIN no permitido")
+        if word in _JOIN_WORDS:
+            if i > 0 and words[i - 1][0] == "NATURAL":
+                continue
+            if word == "STRAIGHT_JOIN" and i > 0 and words[i - 1][0] in _SELECT_MODIFIERS:
+                continue
+            for following, following_depth in words[i + 1:]:
+                if following_depth < depth:
+                    break
+                if following_depth == depth and following in ("ON", "USING"):
+                    break
+                if following_depth == depth and (following in _JOIN_WORDS or following in _CLAUSE_END):
+                    raise UnsafeQueryError("JOIN sin condición ON/USING")
+            else:
+                raise UnsafeQueryError("JOIN sin condición ON/USING")
+        if word == "FROM":
+            for following, following_depth in words[i + 1:]:
+                if following_depth < depth or (following_depth == depth and following in _CLAUSE_END):
+                    break
+                if following_depth == depth and following == ",":
+                    raise UnsafeQueryError("Tablas separadas por comas: use JOIN ... ON")
+
+
+def _clamp_limit(tokens, max_limit):
+    """
+    Reemplazos para agregar LIMIT al nivel superior o reducir el existente a
+    `max_limit` (lista de (inicio, fin, texto) sobre el SQL original).
+    """
+    top_limits = [i for i, (kind, text, depth, _, _) in enumerate(tokens)
+                  if depth == 0 and kind == "word" and text.upper() == "LIMIT"]
+    if not top_limits:
+        end = tokens[-1][4]
+        return [(end, end, f" LIMIT {max_limit}")]
+
+    # Forma de lo que sigue a LIMIT: n | desplazamiento, n | n OFFSET desplazamiento
+    rest = tokens[top_limits[-1] + 1:]
+    shape = ["n" if kind == "number" else text.upper() for kind, text, *_ in rest]
+    if shape == ["n"] or shape == ["n", "OFFSET", "n"]:
+        count = rest[0]
+    elif shape == ["n", ",", "n"]:
+        count = rest[2]
+    else:
+        raise UnsafeQueryError("LIMIT no reconocido")
+    if not count[1].isdigit():
+        raise UnsafeQueryError("LIMIT no reconocido")
+    if int(count[1]) <= max_limit:
+        return []
+    return [(count[3], count[4], str(max_limit))]
+
+
+def guard_sql(sql, max_limit=50, timeout_ms=None):
+    """
+    Validar y normalizar una consulta generada. Devuelve el SQL listo para
+    ejecutar o lanza UnsafeQueryError con el motivo del rechazo.
+    """
+    sql = re.sub(r"```sql|```", "", sql).strip()
+    tokens = _tokenize(sql)
+    while tokens and tokens[-1][1] == ";":
+        tokens.pop()
+    if not tokens:
+        raise UnsafeQueryError("Consulta vacía")
+    if any(text == ";" for _, text, *_ in tokens):
+        raise UnsafeQueryError("Solo se permite una sentencia")
+    if tokens[0][0] != "word" or tokens[0][1].upper() != "SELECT":
+        raise UnsafeQueryError("Solo se permiten consultas SELECT")
+    for kind, text, *_ in tokens:
+        if kind == "word" and text.upper() in FORBIDDEN_KEYWORDS:
+            raise UnsafeQueryError(f"Palabra clave no permitida: {text.upper()}")
+        if kind == "symbol" and text == "@":
+            raise UnsafeQueryError("Variables de sesión no permitidas")
+
+    _check_joins(tokens)
+    # Se edita el texto original (no se rearma desde los tokens): solo cambian
+    # el LIMIT y el hint, y lo que sigue al último token (";", comentarios) se descarta
+    edits = _clamp_limit(tokens, max_limit)
+    if timeout_ms:
+        # Hint de MySQL: el servidor aborta la consulta al superar el tiempo,
+        # sin tocar la configuración de la sesión de la conexión del pool
+        select_end = tokens[0][4]
+        edits.append((select_end, select_end, f" /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */"))
+    return _splice(sql[:tokens[-1][4]], edits)
+
+
+def estimate_examined_rows(plan):
+    """
+    Filas examinadas estimadas a partir de un EXPLAIN de MySQL: en un join
+    anidado cada tabla se recorre una vez por fila de las anteriores.
+    """
+    total = 0
+    for row in plan:
+        rows = int(row.get("rows") or 1)
+        total = rows if total == 0 else total * rows
+    return total
+
+
+if __name__ == "__main__":
+    samples = [
+        "SELECT p.nombre, c.nombre FROM productos p JOIN categorias c ON p.id_categoria = c.id ORDER BY p.nombre",
+        "SELECT * FROM movimientos_inventario LIMIT 10000;",
+        "SELECT * FROM productos LIMIT 20, 500",
+        "SELECT * FROM productos p, movimientos_inventario m",
+        "SELECT * FROM productos p, movimientos_inventario m WHERE p.cantidad > 0",
+        "SELECT * FROM productos p STRAIGHT_JOIN movimientos_inventario m",
+        "SELECT * FROM productos p STRAIGHT_JOIN movimientos_inventario m ON m.id_producto = p.id",
+        "SELECT STRAIGHT_JOIN nombre FROM productos WHERE id IN (1, 2)",
+        "SELECT * FROM productos CROSS JOIN movimientos_inventario",
+        "SELECT * FROM productos p JOIN movimientos_inventario m",
+        "DELETE FROM productos",
+        "SELECT 1; DROP TABLE productos",
+        "SELECT nombre FROM productos WHERE nombre = 'DROP; x,y' -- comentario",
+        "SELECT REPLACE(nombre, 'a', 'b') FROM productos WHERE id IN (1, 2) LIMIT 5 OFFSET 10",
+        "SELECT nombre FROM productos INTO OUTFILE '/tmp/x'",
+    ]
+    for sample in samples:
+        try:
+            print(f"✅ {guard_sql(sample, timeout_ms=5000)}")
+        except UnsafeQueryError as e:
+            print(f"⛔ {e}: {sample}")
+
+    # Regresión: los operadores de varios caracteres no se separan
+    comparisons = ("SELECT nombre FROM productos WHERE cantidad <= 10 AND precio_venta >= 5 "
+                   "AND id != 3 AND id <> 4 AND id_categoria <=> NULL")
+    guarded = guard_sql(comparisons)
+    assert guarded == comparisons + " LIMIT 50", guarded
+    print(f"✅ Operadores de comparación intactos: {guarded}")
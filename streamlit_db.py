@@ -2,6 +2,11 @@ import streamlit as st
 import pandas as pd
 import mysql.connector
 import plotly.express as px
+from database_agent import ConnectionPool, InventorySummary, StockIndex, WatermarkCache, build_query
+from result_stream import fetch_result
+
+RESULT_MAX_ROWS = 50000
+RESULT_MAX_BYTES = 64 * 1024 * 1024
 
 # --- CONFIGURACIÓN DE LA PÁGINA ---
 st.set_page_config(
@@ -11,12 +16,11 @@ st.set_page_config(
 )
 
 # --- CONEXIÓN A LA BASE DE DATOS ---
-# Inicializa la conexión.
-# Streamlit usa st.connection para manejar las conexiones de forma segura y eficiente.
-@st.cache_resource
-def init_connection():
+# Inicializa un pool de conexiones compartido entre sesiones.
+# Una única conexión compartida no es segura cuando varias sesiones consultan a la vez.
+def _load_mysql_config():
     try:
-        return mysql.connector.connect(**st.secrets["connections"]["mysql"])
+        return dict(st.secrets["connections"]["mysql"])
     except KeyError:
         # Fallback: leer directamente del archivo si st.secrets falla
         import toml
@@ -24,17 +28,107 @@ def init_connection():
         secrets_path = os.path.join(os.path.dirname(__file__), ".streamlit", "secrets.toml")
         with open(secrets_path, 'r') as f:
             secrets = toml.load(f)
-        return mysql.connector.connect(**secrets["connections"]["mysql"])
+        return secrets["connections"]["mysql"]
 
-conn = init_connection()
+@st.cache_resource
+def init_connection():
+    db_config = _load_mysql_config()
+    return ConnectionPool(lambda: mysql.connector.connect(**db_config))
+
+pool = init_connection()
 
 # --- FUNCIONES PARA CONSULTAS ---
-# Usa st.cache_data para que las consultas no se ejecuten en cada re-renderizado.
-@st.cache_data(ttl=600) # Cache por 10 minutos
-def run_query(query):
-    with conn.cursor(dictionary=True) as cur:
-        cur.execute(query)
-        return cur.fetchall()
+def _fetch(query, params=None, capped=True):
+    # Lectura por lotes (tuplas + columnas) con los límites por defecto del agente;
+    # los índices en memoria leen sin límite (capped=False) para no quedar incompletos
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params or ())
+            if not capped:
+                return fetch_result(cur)
+            return fetch_result(cur, max_rows=RESULT_MAX_ROWS, max_bytes=RESULT_MAX_BYTES)
+
+def _fetch_all(query, params=None):
+    return _fetch(query, params, capped=False)
+
+# Caché compartida entre sesiones que solo se invalida cuando cambian
+# movimientos_inventario o productos (en vez de un TTL ciego de 10 minutos).
+@st.cache_resource
+def init_query_cache():
+    return WatermarkCache(_fetch)
+
+query_cache = init_query_cache()
+
+def run_query(query, params=None):
+    return query_cache.fetch(query, params)
+
+# Índice en memoria por cantidad y caducidad, compartido entre sesiones: mover el
+# slider de bajo stock es una búsqueda binaria, no un filtro sobre todo el inventario
+@st.cache_resource
+def init_stock_index():
+    return StockIndex(_fetch_all)
+
+stock_index = init_stock_index()
+
+# Resúmenes por categoría y proveedor mantenidos con los movimientos: los
+# gráficos de distribución no recorren la tabla de productos en cada carga
+@st.cache_resource
+def init_inventory_summary():
+    return InventorySummary(_fetch_all)
+
+inventory_summary = init_inventory_summary()
+
+# Tipos por columna para cargar los resultados directamente en columnas tipadas
+PRODUCT_DTYPES = {
+    "id": "int32",
+    "cantidad": "int32",
+    "precio_venta": "float64",  # DECIMAL de MySQL
+    "categoria": "category",
+    "proveedor": "category",
+    "fecha_caducidad": "datetime64[ns]",
+}
+SUMMARY_DTYPES = {
+    "total_productos": "int32",
+    "total_unidades": "float64",  # SUM() devuelve DECIMAL (o NULL sin productos)
+    "valor_inventario": "float64",
+    "por_vencer": "int32",
+}
+
+def _typed_column(values, dtype):
+    if dtype is None:
+        return pd.Series(values, dtype=object)
+    if dtype.startswith("datetime"):
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce")
+    if dtype.startswith("int") and any(value is None for value in values):
+        dtype = dtype.capitalize()  # Entero con nulos (Int32)
+    return pd.Series(values, dtype=dtype)
+
+def load_frame(query, params=None, dtypes=None):
+    """
+    Ejecutar la consulta y construir el DataFrame columna por columna a partir
+    de las tuplas, con el tipo indicado en `dtypes` (sin pasar por una lista
+    de diccionarios ni inferir tipos fila a fila).
+    """
+    return frame_from_result(run_query(query, params), dtypes)
+
+def frame_from_result(results, dtypes=None):
+    """DataFrame con columnas tipadas a partir de un ResultSet"""
+    dtypes = dtypes or {}
+    columns = list(zip(*results.rows)) if results.rows else [()] * len(results.columns)
+    frame = pd.DataFrame({
+        name: _typed_column(values, dtypes.get(name))
+        for name, values in zip(results.columns, columns)
+    })
+    frame.attrs["truncated"] = results.truncated
+    return frame
+
+def summary_frame(group, fallback_query):
+    """Resumen materializado de `group` como DataFrame (con el GROUP BY como respaldo)"""
+    try:
+        return frame_from_result(inventory_summary.rows(group), SUMMARY_DTYPES)
+    except Exception as e:
+        print(f"Warning: Resumen de inventario no disponible, consultando MySQL: {e}")
+        return load_frame(*build_query(fallback_query), dtypes=SUMMARY_DTYPES)
 
 # --- APLICACIÓN PRINCIPAL ---
 
@@ -59,10 +153,11 @@ LEFT JOIN proveedores pr ON p.id_proveedor = pr.id
 ORDER BY p.nombre;
 """
 
-# Ejecutar la consulta y cargar en un DataFrame de Pandas
+# Ejecutar la consulta y cargar en un DataFrame de Pandas con columnas tipadas
 try:
-    results = run_query(query_productos)
-    df_productos = pd.DataFrame(results)
+    df_productos = load_frame(query_productos, dtypes=PRODUCT_DTYPES)
+    if df_productos.attrs["truncated"]:
+        st.warning(f"Se muestran solo los primeros {len(df_productos)} productos.")
 
     # Mostrar la tabla de datos interactiva
     st.dataframe(df_productos, use_container_width=True)
@@ -72,12 +167,15 @@ try:
     # --- VISUALIZACIONES ---
     st.header("📊 Visualizaciones del Inventario")
 
+    # Cada gráfico recibe una fila por categoría o proveedor desde los resúmenes
+    # materializados (o desde el GROUP BY en MySQL si no están disponibles)
     col1, col2 = st.columns(2)
 
     with col1:
         # Gráfico 1: Cantidad de productos por categoría
         st.subheader("Productos por Categoría")
-        df_cat_count = df_productos['categoria'].value_counts().reset_index()
+        df_cat_count = summary_frame("categoria", "categorias")
+        df_cat_count = df_cat_count[['categoria', 'total_productos']]
         df_cat_count.columns = ['Categoría', 'Número de Productos']
         fig_cat = px.pie(df_cat_count, names='Categoría', values='Número de Productos',
                          title='Distribución de Productos por Categoría')
@@ -86,7 +184,8 @@ try:
     with col2:
         # Gráfico 2: Stock total por proveedor
         st.subheader("Stock Total por Proveedor")
-        df_prov_stock = df_productos.groupby('proveedor')['cantidad'].sum().reset_index()
+        df_prov_stock = summary_frame("proveedor", "proveedores")
+        df_prov_stock = df_prov_stock[['proveedor', 'total_unidades']].fillna(0)
         df_prov_stock.columns = ['Proveedor', 'Stock Total']
         fig_prov = px.bar(df_prov_stock.sort_values('Stock Total', ascending=False),
                           x='Proveedor', y='Stock Total', title='Cantidad de Unidades por Proveedor')
@@ -99,8 +198,14 @@ try:
     # Slider para que el usuario defina qué es "bajo stock"
     umbral_stock_bajo = st.slider('Selecciona el umbral para "bajo stock":', 0, 150, 50)
 
-    # Filtrar productos por debajo del umbral
-    df_bajo_stock = df_productos[df_productos['cantidad'] <= umbral_stock_bajo]
+    # Productos por debajo del umbral (búsqueda binaria en el índice de stock;
+    # si el índice no está disponible, filtro sobre la tabla ya cargada)
+    try:
+        df_bajo_stock = pd.DataFrame(stock_index.below(umbral_stock_bajo), columns=list(df_productos.columns))
+    except Exception as e:
+        print(f"Warning: Índice de stock no disponible, filtrando la tabla cargada: {e}")
+        df_bajo_stock = (df_productos[df_productos['cantidad'] <= umbral_stock_bajo]
+                         .sort_values('cantidad', kind='stable'))
 
     if not df_bajo_stock.empty:
         st.warning(f"Se encontraron {len(df_bajo_stock)} productos con stock igual or inferior a {umbral_stock_bajo} unidades.")
@@ -112,21 +217,31 @@ try:
     # Opción para ver los datos de movimientos
     if st.checkbox("Mostrar historial de movimientos de inventario"):
         st.header("Historial de Movimientos")
-        query_movimientos = """
-        SELECT
-            m.id,
-            p.nombre AS producto,
-            m.tipo_movimiento,
-            m.cantidad,
-            m.fecha,
-            m.descripcion
-        FROM movimientos_inventario m
-        JOIN productos p ON m.id_producto = p.id
-        ORDER BY m.fecha DESC;
-        """
-        results_mov = run_query(query_movimientos)
-        df_movimientos = pd.DataFrame(results_mov)
+
+        # Paginación por keyset (fecha, id): cada página continúa donde terminó la anterior
+        PAGE_SIZE = 200
+
+        def load_movements_page():
+            pages = st.session_state.setdefault("movimientos", [])
+            if pages:
+                last = pages[-1]
+                sql, params = build_query("movimientos_siguientes", fecha=last["fecha"],
+                                          fecha_igual=last["fecha"], id=last["id"], limite=PAGE_SIZE)
+            else:
+                sql, params = build_query("movimientos", limite=PAGE_SIZE)
+            page = run_query(sql, params)
+            pages.extend(page)
+            st.session_state.movimientos_completo = len(page) < PAGE_SIZE
+
+        if "movimientos" not in st.session_state:
+            load_movements_page()
+
+        df_movimientos = pd.DataFrame(st.session_state.movimientos)
         st.dataframe(df_movimientos, use_container_width=True)
+        st.caption(f"Mostrando {len(df_movimientos)} movimientos, del más reciente al más antiguo.")
+
+        if not st.session_state.get("movimientos_completo"):
+            st.button("Cargar más movimientos", on_click=load_movements_page)
 
 except Exception as e:
     st.error(f"Error al conectar o consultar la base de datos: {e}")